@@ -0,0 +1,55 @@
+"""
+Encode and decode time and stored size of synthetic guild trees, in the binary tree format and as the
+dill pickles that were stored before it.
+
+    python bench/bench_codec.py [max_node_count]
+"""
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../folderbot'))
+
+import dill
+
+# noinspection PyUnresolvedReferences
+from tree import Tree
+# noinspection PyUnresolvedReferences
+from codec import serialize_filetree, deserialize_filetree
+from bench_memory import synthetic_items
+
+DEFAULT_MAX_NODE_COUNT = 1_000_000
+
+
+def build_tree(node_count: int) -> Tree:
+    ftree = Tree()
+    nodes = [ftree.root]
+    for parent, name, link in synthetic_items(node_count):
+        nodes.append(ftree.attach_node(nodes[parent], name, link))
+    return ftree
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    max_node_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MAX_NODE_COUNT
+    sys.setrecursionlimit(100_000)  # dill recurses through the node graph
+    print(f"{'nodes':>9} {'format':>7} {'size':>12} {'encode':>10} {'decode':>10}")
+    node_count = 1000
+    while node_count <= max_node_count:
+        ftree = build_tree(node_count)
+        for label, dumps, loads in [
+            ("dill", dill.dumps, dill.loads),
+            ("binary", serialize_filetree, deserialize_filetree),
+        ]:
+            blob, encode_secs = timed(dumps, ftree)
+            _, decode_secs = timed(loads, blob)
+            print(f"{node_count:>9} {label:>7} {len(blob):>12,} {encode_secs * 1000:>8.1f}ms {decode_secs * 1000:>8.1f}ms")
+        node_count *= 10
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Cost of a single upload and a single rm in one very wide directory, with sibling order kept up to date by
+tracking the tail, against rescanning every sibling with util.ensure_last_child_correct after each change
+as the tree used to.
+
+    python bench/bench_fanout.py [entries]
+"""
+import os
+import sys
+import timeit
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../folderbot'))
+
+# noinspection PyUnresolvedReferences
+import util
+# noinspection PyUnresolvedReferences
+from tree import Tree
+
+DEFAULT_ENTRIES = 100_000
+OPS = 200
+
+
+def build_tree(entries: int) -> Tree:
+    ftree = Tree()
+    ftree.create_node("/wide")
+    ftree.create_nodes("/wide", [(f"file{i}.png", f"https://cdn/{i}/file{i}.png") for i in range(entries)])
+    return ftree
+
+
+def upload_and_rm(ftree: Tree, rescan: bool):
+    wide = ftree.get_node_from_path("/wide")
+    for i in range(OPS):
+        ftree.create_node(f"/wide/new{i}.png", is_file=True, link=f"https://cdn/new/{i}/new{i}.png")
+        if rescan:
+            util.ensure_last_child_correct(list(wide.children))
+        ftree.destroy_node(f"/wide/file{i}.png")
+        if rescan:
+            util.ensure_last_child_correct(list(wide.children))
+    ftree.mark_clean()
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ENTRIES
+    print(f"{OPS} uploads and {OPS} rms in a directory of {entries} entries")
+    for label, rescan in [("rescan", True), ("tail", False)]:
+        ftree = build_tree(entries)
+        secs = timeit.timeit(lambda: upload_and_rm(ftree, rescan), number=1)
+        print(f"{label:>7}: {secs / (2 * OPS) * 1e6:10.1f} us/op")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Time for >>find lookups through the name index against scanning every name in the tree, on synthetic guild
+trees, plus the one-off cost of building the index the first time a tree is searched.
+
+    python bench/bench_find.py [max_node_count]
+"""
+import os
+import sys
+import time
+from fnmatch import fnmatchcase
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../folderbot'))
+
+# noinspection PyUnresolvedReferences
+from tree import Tree
+# noinspection PyUnresolvedReferences
+from search import find_nodes
+from bench_memory import synthetic_items
+
+DEFAULT_MAX_NODE_COUNT = 1_000_000
+PATTERNS = ["image12", "folder_1234", "image1?.png", "*.gif"]
+REPEATS = 3
+
+
+def build_tree(node_count: int) -> Tree:
+    ftree = Tree()
+    nodes = [ftree.root]
+    for parent, name, link in synthetic_items(node_count):
+        nodes.append(ftree.attach_node(nodes[parent], name, link))
+    return ftree
+
+
+def scan(ftree: Tree, pattern: str) -> list:
+    is_glob = any(c in pattern for c in "*?[")
+    return [
+        node for node in ftree.iter_nodes()
+        if (fnmatchcase(node.name.lower(), pattern) if is_glob else pattern in node.name.lower())
+    ]
+
+
+def best_ms(fn, *args) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    max_node_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MAX_NODE_COUNT
+    print(f"{'nodes':>9} {'pattern':>12} {'index':>10} {'scan':>10}")
+    node_count = 10_000
+    while node_count <= max_node_count:
+        ftree = build_tree(node_count)
+        start = time.perf_counter()
+        ftree.name_index()
+        print(f"{node_count:>9} {'(build)':>12} {(time.perf_counter() - start) * 1000:>8.1f}ms")
+        for pattern in PATTERNS:
+            indexed = best_ms(lambda: list(find_nodes(ftree, pattern)))
+            scanned = best_ms(scan, ftree, pattern)
+            print(f"{node_count:>9} {pattern:>12} {indexed:>8.2f}ms {scanned:>8.2f}ms")
+        node_count *= 10
+
+
+if __name__ == '__main__':
+    main()
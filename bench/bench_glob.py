@@ -0,0 +1,74 @@
+"""
+Time to resolve glob paths with the pruned walk in pathing, which looks literal names up in each directory and
+only fans out at patterns, against matching the pattern on the path of every node in the tree, on wide guild
+trees of folders with a thousand files each.
+
+    python bench/bench_glob.py [max_node_count]
+"""
+import os
+import sys
+import time
+from fnmatch import fnmatchcase
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../folderbot'))
+
+# noinspection PyUnresolvedReferences
+from tree import Tree
+# noinspection PyUnresolvedReferences
+from pathing import Filepaths
+# noinspection PyUnresolvedReferences
+from util import TreePath
+
+DEFAULT_MAX_NODE_COUNT = 1_000_000
+FILES_PER_DIR = 1000
+PATTERNS = ["/dir1/file1?.png", "/dir1*/file8.png", "/dir?/*.gif", "/**/file7.gif"]
+REPEATS = 3
+
+
+def build_tree(node_count: int) -> Tree:
+    ftree = Tree()
+    for k in range(node_count // FILES_PER_DIR):
+        directory = ftree.attach_node(ftree.root, f"dir{k}", None)
+        for i in range(FILES_PER_DIR):
+            extension = "gif" if i % 100 == 7 else "png"
+            ftree.attach_node(directory, f"file{i}.{extension}", f"https://cdn/{k}/{i}/file{i}.{extension}")
+    return ftree
+
+
+def matches(names: tuple, components: tuple) -> bool:
+    if len(components) == 0:
+        return len(names) == 0
+    if components[0] == "**":
+        return any(matches(names[i:], components[1:]) for i in range(len(names) + 1))
+    return len(names) > 0 and fnmatchcase(names[0], components[0]) and matches(names[1:], components[1:])
+
+
+def scan(ftree: Tree, pattern: str) -> list:
+    components = TreePath.parse(pattern)
+    return [node for node in ftree.iter_nodes() if matches(TreePath.parse(node.get_full_path()), components)]
+
+
+def best_ms(fn, *args) -> float:
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    max_node_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MAX_NODE_COUNT
+    print(f"{'nodes':>9} {'pattern':>18} {'matches':>8} {'pruned':>10} {'scan':>10}")
+    node_count = 10_000
+    while node_count <= max_node_count:
+        ftree = build_tree(node_count)
+        for pattern in PATTERNS:
+            found = len(Filepaths(ftree, pattern).get_target_nodes())
+            pruned = best_ms(Filepaths, ftree, pattern)
+            scanned = best_ms(scan, ftree, pattern)
+            print(f"{node_count:>9} {pattern:>18} {found:>8} {pruned:>8.2f}ms {scanned:>8.2f}ms")
+        node_count *= 10
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Time and nodes materialized for an >>ls of a directory 8 levels deep, loading the whole guild tree from the
+node store against loading only the directories along the path, as guilds grow. Runs against fakeredis,
+so the times leave out network round trips, which are the same one or two for both.
+
+    python bench/bench_lazy.py [max_node_count]
+"""
+import os
+import sys
+import time
+import asyncio
+from types import SimpleNamespace
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../folderbot'))
+
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+
+# noinspection PyUnresolvedReferences
+from storage import NodeStore
+# noinspection PyUnresolvedReferences
+from util import TreePath
+
+DEFAULT_MAX_NODE_COUNT = 100_000
+DEPTH = 8
+FILES_PER_DIR = 1000
+REPEATS = 5
+
+DEEP_PATH = TreePath(f"dir{i}" for i in range(DEPTH))
+CONTEXT = SimpleNamespace(message=SimpleNamespace(guild=SimpleNamespace(id="bench")))
+
+
+async def fill(store: NodeStore, node_count: int):
+    ftree = await store.load(CONTEXT)
+    ftree.create_dirs(DEEP_PATH)
+    ftree.create_nodes(DEEP_PATH, [(f"file{i}.png", f"https://cdn/{i}/file{i}.png") for i in range(10)])
+    for k in range(node_count // FILES_PER_DIR):
+        ftree.create_dirs(f"/fill{k}")
+        ftree.create_nodes(
+            f"/fill{k}", [(f"file{i}.png", f"https://cdn/{i}/file{i}.png") for i in range(FILES_PER_DIR)]
+        )
+    await store.save(CONTEXT, ftree)
+
+
+async def timed_load(load) -> (float, int):
+    best = float("inf")
+    ftree = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        ftree = await load()
+        list(ftree.get_node_from_path(DEEP_PATH).children)
+        best = min(best, time.perf_counter() - start)
+    return best, ftree.node_count
+
+
+async def main():
+    max_node_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MAX_NODE_COUNT
+    print(f"{'nodes':>9} {'load':>8} {'time':>10} {'nodes held':>11}")
+    node_count = 1000
+    while node_count <= max_node_count:
+        store = NodeStore(FakeRedis(server=FakeServer()))
+        await fill(store, node_count)
+        for label, load in [
+            ("full", lambda: store.load(CONTEXT)),
+            ("paths", lambda: store.load_paths(CONTEXT, [DEEP_PATH])),
+        ]:
+            secs, held = await timed_load(load)
+            print(f"{node_count:>9} {label:>8} {secs * 1000:>8.2f}ms {held:>11,}")
+        node_count *= 10
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
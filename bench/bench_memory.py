@@ -0,0 +1,90 @@
+"""
+Memory footprint of a large synthetic guild tree, using the current slotted Node and a replica of the
+original dict-based layout. Each layout is built in its own process so peak RSS is not shared.
+
+    python bench/bench_memory.py [node_count]
+"""
+import os
+import sys
+import random
+import resource
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../folderbot'))
+
+# noinspection PyUnresolvedReferences
+from tree import Tree
+
+DEFAULT_NODE_COUNT = 1_000_000
+DIR_EVERY = 10
+CHANNELS = 20
+
+
+class LegacyNode:
+    """The node layout before slots: a __dict__ per node, a children list per leaf and full link strings."""
+
+    def __init__(self, name, link, parent):
+        self.name = name
+        self.link = link
+        self.parent = parent
+        self.children = []
+        self.is_last_child = False
+
+
+def synthetic_items(node_count: int):
+    """Yields (parent index, name, link) with parents always yielded before their children."""
+    rng = random.Random(0)
+    dirs = [0]
+    pasted_images = {}
+    for i in range(1, node_count):
+        parent = rng.choice(dirs)
+        if i % DIR_EVERY == 0:
+            dirs.append(i)
+            yield parent, f"folder_{i}", None
+        else:
+            if i % 3 == 0:
+                # pasted images are named image0.png, image1.png, ... so the same names recur in every folder
+                pasted_images[parent] = pasted_images.get(parent, -1) + 1
+                name = f"image{pasted_images[parent]}.png"
+            else:
+                name = f"attachment_{i}.png"
+            link = f"https://cdn.discordapp.com/attachments/{900000000000000000 + i % CHANNELS}/" \
+                   f"{950000000000000000 + i}/{name}"
+            yield parent, name, link
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as fh:
+        return int(fh.read().split()[1]) * resource.getpagesize()
+
+
+def measure(layout: str, node_count: int):
+    # the index list of nodes is preallocated so that it is not counted against either layout
+    nodes = [None] * node_count
+    before = rss_bytes()
+    if layout == "current":
+        ftree = Tree()
+        nodes[0] = ftree.root
+        for i, (parent, name, link) in enumerate(synthetic_items(node_count), start=1):
+            nodes[i] = ftree.attach_node(nodes[parent], name, link)
+    else:
+        nodes[0] = LegacyNode("/", None, None)
+        for i, (parent, name, link) in enumerate(synthetic_items(node_count), start=1):
+            nodes[i] = LegacyNode(name, link, nodes[parent])
+            nodes[parent].children.append(nodes[i])
+    nodes_bytes = rss_bytes() - before
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{layout:>8}: {nodes_bytes / node_count:8.1f} bytes/node, peak RSS {peak_kb / 1024:8.1f} MiB")
+
+
+def main():
+    node_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NODE_COUNT
+    print(f"synthetic tree with {node_count} nodes, one folder every {DIR_EVERY} nodes")
+    for layout in ["legacy", "current"]:
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", layout, str(node_count)], check=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--measure":
+        measure(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
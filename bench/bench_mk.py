@@ -0,0 +1,52 @@
+"""
+>>mk of one deep path, creating every missing level in a single walk with Tree.create_dirs, against the
+original approach: look up every prefix from the root to find the missing ones, then sort them and
+create each one with its own lookup from the root.
+
+    python bench/bench_mk.py [levels]
+"""
+import os
+import sys
+import timeit
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../folderbot'))
+
+# noinspection PyUnresolvedReferences
+import util
+# noinspection PyUnresolvedReferences
+import error
+# noinspection PyUnresolvedReferences
+from tree import Tree
+
+DEFAULT_LEVELS = 100
+REPEATS = 50
+
+
+def legacy_required_dirs(filetree: Tree, abs_path: str) -> [str]:
+    cur_filepath = ""
+    required_dirs = []
+    for name in abs_path.split("/"):
+        cur_filepath += f"/{name}"
+        try:
+            filetree.get_node_from_path(cur_filepath)
+        except error.NodeDoesNotExistError:
+            required_dirs.append(util.clean_path(cur_filepath))
+    return required_dirs
+
+
+def legacy_mk(filetree: Tree, abs_path: str):
+    dirs_to_mk = list(set(legacy_required_dirs(filetree, abs_path)))
+    for path in sorted(dirs_to_mk, key=lambda d: len(d.split("/"))):
+        filetree.create_node(path, is_file=False)
+
+
+def main():
+    levels = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_LEVELS
+    abs_path = "/" + "/".join(f"level{i}" for i in range(levels))
+    print(f"mk of a {levels} level path into an empty tree")
+    for label, mk in [("legacy", legacy_mk), ("single", lambda ftree, path: ftree.create_dirs(path))]:
+        secs = timeit.timeit(lambda: mk(Tree(), abs_path), number=REPEATS)
+        print(f"{label:>7}: {secs / REPEATS * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
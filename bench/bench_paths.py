@@ -0,0 +1,51 @@
+"""
+Microbenchmark of the path handling in a typical command pipeline: resolving paths typed by a user, then
+creating, looking up and removing nodes by path as >>mk, >>up, >>cd and >>rm do.
+
+    python bench/bench_paths.py
+"""
+import os
+import sys
+import timeit
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../folderbot'))
+
+# noinspection PyUnresolvedReferences
+from tree import Tree
+# noinspection PyUnresolvedReferences
+from pathing import Filepaths
+
+DEPTH = 8
+OPS = 5_000
+REPEATS = 7
+
+
+def build_tree() -> Tree:
+    ftree = Tree()
+    path = ""
+    for i in range(DEPTH):
+        path += f"/dir{i}"
+        ftree.create_node(path)
+    ftree.create_node("/other")
+    ftree.change_dir(path)
+    return ftree
+
+
+def pipeline(ftree: Tree):
+    for i in range(OPS):
+        target = Filepaths(ftree, "../dir7//").get_target_nodes()[-1]
+        ftree.create_node(f"{target.get_full_path()}/file{i}.png", is_file=True, link=f"https://cdn/{i}/file{i}.png")
+        ftree.get_node_from_path(f"/dir0/dir1/dir2/dir3/dir4/dir5/dir6/dir7/file{i}.png")
+        ftree.change_dir("/other")
+        ftree.change_dir("/dir0/dir1/dir2/dir3/dir4/dir5/dir6/dir7")
+        ftree.destroy_node(f"/dir0/dir1/dir2/dir3/dir4/dir5/dir6/dir7/file{i}.png")
+    ftree.mark_clean()
+
+
+def main():
+    ftree = build_tree()
+    secs = min(timeit.repeat(lambda: pipeline(ftree), number=1, repeat=REPEATS))
+    print(f"{secs / OPS * 1e6:.1f} us per resolve, create, lookup, two cds and rm")
+
+
+if __name__ == '__main__':
+    main()
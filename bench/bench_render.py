@@ -0,0 +1,87 @@
+"""
+Compares the >>tree renderer with the original one, which formatted Tree.traverse() output and patched
+pipes in with util.calculate_prefix and util.replace_substring.
+
+    python bench/bench_render.py
+"""
+import os
+import sys
+import timeit
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../folderbot'))
+
+# noinspection PyUnresolvedReferences
+import util
+# noinspection PyUnresolvedReferences
+import constants as cst
+# noinspection PyUnresolvedReferences
+from tree import Tree
+# noinspection PyUnresolvedReferences
+from render import iter_tree_lines
+
+
+def legacy_render(filetree: Tree) -> str:
+    message = ""
+    for node_details in filetree.traverse():
+        node_filename = f"{node_details['node'].name}"
+        if node_details["is_pwd"]:
+            node_filename = f"__**{node_filename}**__"
+
+        node_str_rep = (
+            f"{cst.FOLDER_OPEN} {node_filename}"
+            if node_details["node"].is_dir()
+            else f"[{node_details['node'].name}]({node_details['node'].link})"
+        )
+
+        if node_details["is_empty_dir"]:
+            node_str_rep = f"{node_str_rep} *(empty)*"
+
+        if len(node_details["drawing_items"]) > 0:
+            mandatory_pipe = node_details["drawing_items"][0]
+            pipe_positions = node_details["drawing_items"][1]
+            node_str_rep = (
+                f"{cst.SPACE * node_details['depth']}{mandatory_pipe} {node_str_rep}"
+            )
+
+            for pos in pipe_positions:
+                node_str_rep = util.replace_substring(cst.PIPE, pos, node_str_rep)
+
+        message = f"{message}\n{node_str_rep}"
+    return message
+
+
+def render_tree(filetree: Tree) -> str:
+    return cst.NEWLINE.join(iter_tree_lines(filetree))
+
+
+def deep_tree(depth: int) -> Tree:
+    # every folder also holds a file, so no folder is the last child and each level draws a pipe
+    ftree = Tree()
+    parent = ftree.root
+    for i in range(depth):
+        folder = ftree.attach_node(parent, f"d{i}", None)
+        ftree.attach_node(parent, f"f{i}.txt", f"abc.com/f{i}.txt")
+        parent = folder
+    return ftree
+
+
+def wide_tree(width: int) -> Tree:
+    ftree = Tree()
+    folder = ftree.attach_node(ftree.root, "wide", None)
+    for i in range(width):
+        ftree.attach_node(folder, f"f{i}.txt", f"abc.com/f{i}.txt")
+    return ftree
+
+
+def bench(label: str, ftree: Tree, number: int):
+    assert legacy_render(ftree) == f"\n{render_tree(ftree)}"
+    legacy = timeit.timeit(lambda: legacy_render(ftree), number=number) / number
+    current = timeit.timeit(lambda: render_tree(ftree), number=number) / number
+    print(f"{label:>12}: legacy {legacy * 1000:9.2f} ms, current {current * 1000:7.2f} ms, "
+          f"{legacy / current:6.1f}x")
+
+
+if __name__ == '__main__':
+    bench("deep 100", deep_tree(100), number=20)
+    bench("deep 400", deep_tree(400), number=3)
+    bench("wide 2000", wide_tree(2000), number=20)
+    bench("wide 20000", wide_tree(20000), number=1)
@@ -1,15 +1,28 @@
-from discord import Embed
+import tempfile
+from itertools import chain, islice
+from typing import IO, Iterable, List, Optional
+
+from discord import Embed, File, Intents
 from discord.ext import commands
 
-import util
 import error
-import redis
+import metrics
 import constants as cst
-from pathing import Filepaths, get_required_parent_dirs_for_mk
-from secret import get_discord_token, get_redis_url, is_production
-from tree import Tree, save_filetree_state, retrieve_filetree_state
-
-bot = commands.Bot(command_prefix=">>", help_command=None)
+from pathing import Filepaths, plan_cache
+from secret import (
+    get_discord_token, get_redis_url, get_redis_pool_size, get_redis_timeout, get_redis_pool_timeout,
+    get_storage_backend, get_tree_cache_size, get_tree_cache_bytes, get_tree_compression, get_compression_min_bytes,
+    get_session_ttl, is_production
+)
+from cache import TreeCache
+from render import format_find_result, format_usage, iter_ls_lines, iter_tree_lines, paginate
+from search import find_nodes
+from storage import connect, make_store
+from tree import Tree
+
+intents = Intents.default()
+intents.message_content = True
+bot = commands.Bot(command_prefix=">>", help_command=None, intents=intents)
 
 
 async def send_message(context, message: str, msg_type: int, msg_title_override: str = None):
@@ -20,6 +33,40 @@ async def send_message(context, message: str, msg_type: int, msg_title_override:
     await context.send(embed=embed)
 
 
+def collect_pages(lines: Iterable[str]) -> List[str]:
+    """The pages send_pages sends for lines, plus one if they do not all fit, to build while holding a lock."""
+    return list(islice(paginate(lines), cst.MAX_EMBED_PAGES + 1))
+
+
+async def send_pages(context, pages: List[str], msg_type: int, msg_title: str, overflow_hint: str = None):
+    for i, page in enumerate(pages):
+        if i == cst.MAX_EMBED_PAGES:
+            message = f"Output is longer than {cst.MAX_EMBED_PAGES} messages and was cut short."
+            if overflow_hint:
+                message = f"{message} {overflow_hint}"
+            await send_message(context, message, cst.MSG_INFO, msg_title_override=f"{msg_title} (truncated)")
+            return
+        page_title = msg_title if i == 0 else f"{msg_title} ({i + 1})"
+        await send_message(context, page, msg_type, msg_title_override=page_title)
+
+
+def write_lines_to_file(lines: Iterable[str]) -> IO[bytes]:
+    fh = tempfile.TemporaryFile()
+    for line in lines:
+        fh.write(f"{line}{cst.NEWLINE}".encode())
+    fh.seek(0)
+    return fh
+
+
+async def send_file(context, fh: IO[bytes], filename: str):
+    with fh:
+        file = File(fh, filename=filename)
+        try:
+            await context.send(file=file)
+        finally:
+            file.close()  # gives fh its own close back, which File stubs out while sending
+
+
 async def send_help_msg(context, command: str = "folderbot"):
     if command == "folderbot":
         message = "\n\n".join(cst.HELP_STRINGS.values())
@@ -38,6 +85,9 @@ async def send_help_msg(context, command: str = "folderbot"):
 async def on_command_error(ctx, err):
     if isinstance(err, commands.errors.CommandNotFound):
         await send_help_msg(ctx)
+    elif isinstance(err, commands.errors.CommandInvokeError) and \
+            isinstance(err.original, error.ConcurrentModificationError):
+        await send_message(ctx, str(err.original), cst.MSG_ERR, msg_title_override=f"error: {ctx.command.name}")
 
 
 @bot.command(name="help")
@@ -47,26 +97,12 @@ async def folderbot_help(ctx, command="folderbot"):
 
 @bot.command(name="rm")
 async def remove(ctx, *paths):
-    filetree = retrieve_filetree_state(database, ctx)
     if len(paths) == 0:
         err = error.NoPathsProvidedError("rm")
         await send_message(ctx, str(err), cst.MSG_ERR, msg_title_override="error: rm")
         return
 
-    success = []
-    fail = []
-    for path in paths:
-        try:
-            abs_paths = Filepaths(filetree, path)
-            target_nodes = abs_paths.get_target_nodes()
-            for node in target_nodes:
-                full_filepath = node.get_full_path()
-                filetree.destroy_node(full_filepath)
-                success.append(full_filepath)
-
-        except (error.CdPreviousFromRootError, error.InvalidFilepathError, error.NodeDoesNotExistError) as err:
-            fail.append((err, path))
-
+    success, fail = await store.update(ctx, lambda filetree: _rm_paths(filetree, *paths), label="rm")
     if len(success) > 0:
         message = f"**Removed these items successfully:**\n{cst.NEWLINE.join(i for i in success)}"
         await send_message(ctx, message, cst.MSG_INFO, msg_title_override="rm")
@@ -76,49 +112,53 @@ async def remove(ctx, *paths):
                   f"\n{cst.NEWLINE.join(name + ' -> ' + str(msg) for msg, name in fail)}"
         await send_message(ctx, message, cst.MSG_ERR, msg_title_override="error: rm")
 
-    save_filetree_state(database, ctx, filetree)
 
+def _is_under_any(node, ancestors: set) -> bool:
+    node = node.parent
+    while node is not None:
+        if node in ancestors:
+            return True
+        node = node.parent
+    return False
 
-@bot.command(name="mk")
-async def mkdirs(ctx, *paths):
-    filetree = retrieve_filetree_state(database, ctx)
-    if len(paths) == 0:
-        err = error.NoPathsProvidedError("mk")
-        await send_message(ctx, str(err), cst.MSG_ERR, msg_title_override="error: mk")
-        return
 
+def _rm_paths(filetree: Tree, *paths):
     success = []
     fail = []
+    targets = []  # (path, node), with every path resolved before anything is removed
     for path in paths:
-        cd_from_root = False
-        dirs_to_mk = []
-        final_abs_path = ""
         try:
-            abs_paths = Filepaths(filetree, path, is_mk_cmd=True)
-            abs_paths = abs_paths.get_target_nodes()
-            for p in abs_paths:
-                final_abs_path = p
-                dirs_to_mk += get_required_parent_dirs_for_mk(filetree, p)
-
-        except (error.CdPreviousFromRootError, error.InvalidFilepathError) as err:
+            abs_paths = Filepaths(filetree, path)
+            matched = abs_paths.get_target_nodes()
+            if any(node is filetree.root for node in matched):
+                fail.append((error.CannotRmRootError(), path))
+                matched = [node for node in matched if node is not filetree.root]
+            # a glob can match a folder along with things inside it, which are removed with the folder
+            matched_set = set(matched)
+            targets += [(path, node) for node in matched if not _is_under_any(node, matched_set)]
+        except (error.CdPreviousFromRootError, error.InvalidFilepathError, error.NodeDoesNotExistError) as err:
             fail.append((err, path))
-            if isinstance(err, error.CdPreviousFromRootError):
-                cd_from_root = True
 
-        dirs_to_mk = list(set(dirs_to_mk))
-        dirs_to_mk = sorted(dirs_to_mk, key=lambda d: len(d.split("/")))
-        if len(dirs_to_mk) == 0 and not cd_from_root:
-            node_name = path.split("/")[-1]
-            err = error.NodeExistsError(final_abs_path)
-            fail.append((err, node_name))
-            continue
+    _, missing = filetree.destroy_nodes(node for _, node in targets)
+    missing = set(missing)
+    for path, node in targets:
+        full_filepath = node.get_full_path()
+        if node in missing:
+            fail.append((error.NodeDoesNotExistError(full_filepath), path))
+        else:
+            success.append(full_filepath)
+
+    return success, fail
 
-        s, f = await _mkdirs(filetree, *dirs_to_mk)
-        if len(s) > 0:
-            success += s
 
-        if len(f) > 0:
-            fail.append(f[-1])
+@bot.command(name="mk")
+async def mkdirs(ctx, *paths):
+    if len(paths) == 0:
+        err = error.NoPathsProvidedError("mk")
+        await send_message(ctx, str(err), cst.MSG_ERR, msg_title_override="error: mk")
+        return
+
+    success, fail = await store.update(ctx, lambda filetree: _mk_paths(filetree, *paths), label="mk")
     if len(success) > 0:
         message = f"**Created these folders successfully:**\n{cst.NEWLINE.join(i for i in success)}"
         await send_message(ctx, message, cst.MSG_INFO, msg_title_override="mk")
@@ -128,170 +168,248 @@ async def mkdirs(ctx, *paths):
                   f"\n{cst.NEWLINE.join(name + ' -> ' + str(msg) for msg, name in fail)}"
         await send_message(ctx, message, cst.MSG_ERR, msg_title_override="error: mk")
 
-    save_filetree_state(database, ctx, filetree)
-
 
-async def _mkdirs(filetree: Tree, *paths):
+def _mk_paths(filetree: Tree, *paths):
     success = []
     fail = []
     for path in paths:
-        path = util.clean_path(path)
-        if path[0] != "/":
-            path = util.clean_path(f"{filetree.get_pwd_path()}/{path}")
         try:
-            filetree.create_node(path, is_file=False)
-        except (
-                error.NodeDoesNotExistError,
-                error.NodeExistsError,
-                error.CreateNodeUnderFileError,
-        ) as err:
-            fail.append((err, path.split("/")[-1]))
-        success.append(path)
+            abs_paths = Filepaths(filetree, path, is_mk_cmd=True).get_target_nodes()
+        except (error.CdPreviousFromRootError, error.InvalidFilepathError) as err:
+            fail.append((err, path))
+            continue
 
-    return success, fail
+        created = []
+        failed = []
+        for abs_path in abs_paths:
+            try:
+                created += filetree.create_dirs(abs_path)
+            except error.CreateNodeUnderFileError as err:
+                failed.append((err, abs_path.name))
 
+        if len(created) == 0 and len(failed) == 0:
+            node_name = path.split("/")[-1]
+            err = error.NodeExistsError(abs_paths[-1])
+            fail.append((err, node_name))
+            continue
 
-async def _rmdirs(filetree: Tree, *paths):
-    success = []
-    fail = []
-    for path in paths:
-        path = util.clean_path(path)
-        if path[0] != "/":
-            path = util.clean_path(f"{filetree.get_pwd_path()}/{path}")
-        try:
-            filetree.destroy_node(path)
-            success.append(path)
-        except (
-                error.NodeDoesNotExistError, error.CannotRmRootError
-        ) as err:
-            if path == "/":
-                fail.append((err, path))
-            else:
-                fail.append((err, path.split("/")[-1]))
+        success += [node.get_full_path() for node in created]
+        if len(failed) > 0:
+            fail.append(failed[-1])
 
     return success, fail
 
 
-@bot.command(name="tree")
-async def tree(ctx):
-    filetree = retrieve_filetree_state(database, ctx)
-    traversed_nodes = filetree.traverse()
-    message = ""
-    for node_details in traversed_nodes:
-        node_filename = f"{node_details['node'].name}"
-        if node_details["is_pwd"]:
-            node_filename = f"__**{node_filename}**__"
-
-        node_str_rep = (
-            f"{cst.FOLDER_OPEN} {node_filename}"
-            if node_details["node"].is_dir()
-            else f"[{node_details['node'].name}]({node_details['node'].link})"
-        )
+def parse_tree_options(options) -> (Optional[str], Optional[int], bool):
+    path = None
+    max_depth = None
+    as_file = False
+    options = iter(options)
+    for option in options:
+        if option == cst.TREE_FILE_FLAG:
+            as_file = True
+        elif option == cst.TREE_DEPTH_FLAG:
+            depth = next(options, None)
+            if depth is None or not depth.isdigit():
+                raise error.InvalidOptionError(cst.TREE_DEPTH_FLAG, "expected a number of levels after it")
+            max_depth = int(depth)
+        elif path is None:
+            path = option
+        else:
+            raise error.InvalidOptionError(option, "only one path can be given")
 
-        if node_details["is_empty_dir"]:
-            node_str_rep = f"{node_str_rep} *(empty)*"
+    return path, max_depth, as_file
 
-        if len(node_details["drawing_items"]) > 0:
-            mandatory_pipe = node_details["drawing_items"][0]
-            pipe_positions = node_details["drawing_items"][1]
-            node_str_rep = (
-                f"{cst.SPACE * node_details['depth']}{mandatory_pipe} {node_str_rep}"
-            )
 
-            for pos in pipe_positions:
-                node_str_rep = util.replace_substring(cst.PIPE, pos, node_str_rep)
+@bot.command(name="tree")
+async def tree(ctx, *options):
+    async with store.reading(ctx) as filetree:
+        try:
+            path, max_depth, as_file = parse_tree_options(options)
+            start = filetree.root if path is None else Filepaths(filetree, path).get_target_nodes()[-1]
+        except (
+                error.InvalidOptionError,
+                error.InvalidFilepathError,
+                error.CdPreviousFromRootError,
+                error.NodeDoesNotExistError,
+        ) as err:
+            start = None
+            message = str(err)
 
-        message = f"{message}\n{node_str_rep}"
-    print(len(message))
-    # TODO: Discord embeds have a char limit of 6000, how to work around this?
-    await send_message(ctx, message, cst.MSG_OK, msg_title_override=f"Current directory: {filetree.get_pwd_path()}")
+        if start is not None:
+            lines = iter_tree_lines(filetree, start, max_depth)
+            if as_file:
+                fh = write_lines_to_file(lines)
+            else:
+                pages = collect_pages(lines)
+                title = f"Current directory: {filetree.get_pwd_path()}" if path is None \
+                    else f"tree: {start.get_full_path()}"
+
+    if start is None:
+        await send_message(ctx, message, cst.MSG_ERR, msg_title_override="error: tree")
+    elif as_file:
+        await send_file(ctx, fh, cst.TREE_FILE_NAME)
+    else:
+        await send_pages(
+            ctx, pages, cst.MSG_OK, title,
+            overflow_hint=f"Use {cst.TREE_DEPTH_FLAG} to show fewer levels, "
+                          f"or {cst.TREE_FILE_FLAG} to get the whole tree as a file."
+        )
+
+
+@bot.command(name="stats")
+async def stats(ctx):
+    lines = []
+    for group, counters in sorted(metrics.groups().items()):
+        if group == "compression":
+            continue  # kept per server, see below
+        lines.append(f"**{group}**")
+        lines += [f"{name}: {count}" for name, count in sorted(counters.items())]
+    if tree_cache.hit_ratio() is not None:
+        lines.append(f"tree cache hit ratio: {tree_cache.hit_ratio():.1%} ({len(tree_cache)} trees cached)")
+    if plan_cache.hit_ratio() is not None:
+        lines.append(f"path plan hit ratio: {plan_cache.hit_ratio():.1%} ({len(plan_cache)} plans cached)")
+    lines += _compression_stats(ctx.message.guild.id)
+    message = cst.NEWLINE.join(lines) if len(lines) > 0 else "*(no metrics yet)*"
+    await send_message(ctx, message, cst.MSG_INFO, msg_title_override="stats")
+
+
+def _compression_stats(server_id) -> [str]:
+    counters = metrics.get("compression")
+    raw_bytes, stored_bytes, snapshots, compress_us, loads, decompress_us = (
+        counters.get(f"{server_id}.{name}", 0)
+        for name in ["raw_bytes", "stored_bytes", "snapshots", "compress_us", "loads", "decompress_us"]
+    )
+    lines = []
+    if snapshots > 0:
+        lines.append(
+            f"snapshot compression: {raw_bytes / stored_bytes:.1f}x, "
+            f"{compress_us / snapshots / 1000:.2f}ms CPU per snapshot"
+        )
+    if loads > 0:
+        lines.append(f"snapshot decompression: {decompress_us / loads / 1000:.2f}ms CPU per load")
+    return lines
 
 
 @bot.command(name="pwd")
 async def pwd(ctx):
-    filetree = retrieve_filetree_state(database, ctx)
-    message = f"Current directory: {filetree.get_pwd_path()}"
+    async with store.reading(ctx, paths=[]) as filetree:
+        message = f"Current directory: {filetree.get_pwd_path()}"
     await send_message(ctx, message, cst.MSG_INFO, msg_title_override="pwd")
 
 
 @bot.command(name="cd")
 async def cd(ctx, directory="/"):
-    filetree = retrieve_filetree_state(database, ctx)
     try:
-        filetree.change_dir(directory)
-        message = f"Current directory: {filetree.get_pwd_path()}"
+        pwd_path = await store.change_dir(ctx, directory)
+        message = f"Current directory: {pwd_path}"
         await send_message(ctx, message, cst.MSG_INFO)
     except (
             error.CannotCdError,
             error.CdPreviousFromRootError,
+            error.InvalidFilepathError,
             error.NodeDoesNotExistError,
     ) as err:
         await send_message(ctx, str(err), cst.MSG_ERR, msg_title_override="error: cd")
 
-    save_filetree_state(database, ctx, filetree)
-
 
 @bot.command(name="ls")
-async def ls(ctx, directory: str = None, cols=cst.LS_GRID_COLS):
-    filetree = retrieve_filetree_state(database, ctx)
-    if directory is None:
-        directory = filetree.get_pwd_path()
-    try:
-        abs_paths = Filepaths(filetree, directory)
-        node = abs_paths.get_target_nodes()[-1]
-        if not node.is_dir():
-            raise error.CannotLsError(directory)
-
-        ls_items = []
-        for child in node.children:
-            ls_items.append((child.name, child.link, child.is_dir()))
-        lines = []
-        if len(ls_items) == 0:
-            lines.append("*(empty)*")
-        for x in range(0, len(ls_items), cols):
-            line = ""
-            cur_batch = ls_items[x: x + cols]
-            for name, link, is_dir in cur_batch:
-                if is_dir:
-                    line += f"{cst.FOLDER_OPEN}{name}{cst.SPACE}"
-                else:
-                    line += f"[{name}]({link}){cst.SPACE}"
-            lines.append(line)
-        ls_str = "\n".join(lines)
-        await send_message(ctx, ls_str, cst.MSG_LS, msg_title_override=f"ls: {node.get_full_path()}")
-    except (error.NodeDoesNotExistError, error.CannotLsError) as err:
-        await send_message(ctx, str(err), cst.MSG_ERR, msg_title_override="error: ls")
-
+async def ls(ctx, directory: str = None, cols: int = cst.LS_GRID_COLS):
+    async with store.reading(ctx, paths=[] if directory is None else [directory]) as filetree:
+        if directory is None:
+            directory = filetree.get_pwd_path()
+        try:
+            abs_paths = Filepaths(filetree, directory)
+            node = abs_paths.get_target_nodes()[-1]
+            if not node.is_dir():
+                raise error.CannotLsError(directory)
+            pages = collect_pages(iter_ls_lines(node, cols))
+            title = f"ls: {node.get_full_path()}"
+        except (
+                error.InvalidFilepathError,
+                error.CdPreviousFromRootError,
+                error.NodeDoesNotExistError,
+                error.CannotLsError,
+        ) as err:
+            pages = None
+            message = str(err)
 
-@bot.command(name="up")
-async def upload(ctx, directory=None):
-    filetree = retrieve_filetree_state(database, ctx)
-    message = ctx.message
-    if directory is None:
-        directory = filetree.get_pwd_path()
+    if pages is None:
+        await send_message(ctx, message, cst.MSG_ERR, msg_title_override="error: ls")
     else:
+        await send_pages(ctx, pages, cst.MSG_LS, title)
+
+
+@bot.command(name="du")
+async def du(ctx, path: str = None):
+    async with store.reading(ctx, paths=[] if path is None else [path]) as filetree:
         try:
-            directory = str(Filepaths(filetree, directory))
-            filetree.get_node_from_path(directory)
-        except error.NodeDoesNotExistError as err:
-            await send_message(ctx, str(err), cst.MSG_ERR, msg_title_override="error: up")
-            return
+            node = filetree.pwd if path is None else Filepaths(filetree, path).get_target_nodes()[-1]
+            message = f"{node.get_full_path()}: {format_usage(node)}"
+            msg_type, msg_title = cst.MSG_INFO, "du"
+        except (error.InvalidFilepathError, error.CdPreviousFromRootError, error.NodeDoesNotExistError) as err:
+            message = str(err)
+            msg_type, msg_title = cst.MSG_ERR, "error: du"
+    await send_message(ctx, message, msg_type, msg_title_override=msg_title)
+
+
+@bot.command(name="find")
+async def find(ctx, pattern: str = None, path: str = None):
+    if pattern is None:
+        err = error.NoPatternProvidedError("find")
+        await send_message(ctx, str(err), cst.MSG_ERR, msg_title_override="error: find")
+        return
 
-    files = message.attachments
+    # searches need the whole tree, which is usually cached, so it is not loaded by path
+    async with store.reading(ctx) as filetree:
+        try:
+            start = filetree.root if path is None else Filepaths(filetree, path).get_target_nodes()[-1]
+            if not start.is_dir():
+                raise error.CannotFindError(start.get_full_path())
+        except (
+                error.InvalidFilepathError,
+                error.CdPreviousFromRootError,
+                error.NodeDoesNotExistError,
+                error.CannotFindError,
+        ) as err:
+            start = None
+            message = str(err)
+
+        pages = None
+        if start is not None:
+            found = find_nodes(filetree, pattern, start)
+            first = next(found, None)
+            if first is None:
+                message = f"Nothing under {start.get_full_path()} matches {pattern}"
+            else:
+                pages = collect_pages(format_find_result(node) for node in chain([first], found))
+
+    if start is None:
+        await send_message(ctx, message, cst.MSG_ERR, msg_title_override="error: find")
+    elif pages is None:
+        await send_message(ctx, message, cst.MSG_INFO, msg_title_override="find")
+    else:
+        await send_pages(
+            ctx, pages, cst.MSG_OK, f"find: {pattern}",
+            overflow_hint="Use a longer pattern, or give a path to search under."
+        )
+
+
+@bot.command(name="up")
+async def upload(ctx, directory=None):
+    files = ctx.message.attachments
     if len(files) == 0 or files is None:
         err = error.NoAttachmentsInMessageError()
         await send_message(ctx, str(err), cst.MSG_ERR, msg_title_override="error: up")
         return
 
-    success = []
-    fail = []
-    for file in files:
-        filename = str(file).split("/")[-1]
-        try:
-            filetree.create_node(f"{directory}/{filename}", is_file=True, link=file)
-            success.append(f"[{filename}]({file})")
-        except (error.NodeExistsError, error.CreateNodeUnderFileError) as err:
-            fail.append((err, filename))
+    try:
+        directory, success, fail = await store.update(
+            ctx, lambda filetree: _upload_files(filetree, directory, files), label="up"
+        )
+    except (error.NodeDoesNotExistError, error.CdPreviousFromRootError, error.InvalidFilepathError) as err:
+        await send_message(ctx, str(err), cst.MSG_ERR, msg_title_override="error: up")
+        return
 
     if len(success) > 0:
         message = f"**Uploaded these files successfully to {directory}:**" \
@@ -303,9 +421,29 @@ async def upload(ctx, directory=None):
                   f"\n{cst.NEWLINE.join(name + ' -> ' + str(msg) for msg, name in fail)}"
         await send_message(ctx, message, cst.MSG_ERR, msg_title_override="error: up")
 
-    save_filetree_state(database, ctx, filetree)
+
+def _upload_files(filetree: Tree, directory: Optional[str], files) -> (str, [str], []):
+    if directory is None:
+        directory = filetree.get_pwd_path()
+    else:
+        directory = Filepaths(filetree, directory).get_target_nodes()[-1].get_full_path()
+
+    children = [(str(file).split("/")[-1], str(file), file.size) for file in files]
+    created, fail = filetree.create_nodes(directory, children)
+    success = [f"[{node.name}]({node.link})" for node in created]
+
+    return directory, success, fail
 
 
 if __name__ == '__main__':
-    database = redis.from_url(get_redis_url())
+    database = connect(get_redis_url(), get_redis_pool_size(), get_redis_timeout(), get_redis_pool_timeout())
+    tree_cache = TreeCache(get_tree_cache_size(), get_tree_cache_bytes())
+    store = make_store(
+        database,
+        get_storage_backend(),
+        cache=tree_cache,
+        compression=get_tree_compression(),
+        compression_min_bytes=get_compression_min_bytes(),
+        session_ttl=get_session_ttl(),
+    )
     bot.run(get_discord_token())
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+from typing import Optional
+
+import metrics
+import constants as cst
+
+
+class TreeCache:
+    """
+    Bounded LRU of live Tree objects keyed by guild id. Entries are dropped when either the number of
+    trees or their estimated memory footprint goes over the limit.
+    """
+    max_trees: int
+    max_bytes: int
+
+    def __init__(self, max_trees: int, max_bytes: int):
+        self.max_trees = max_trees
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    @staticmethod
+    def estimate_bytes(ftree) -> int:
+        return ftree.node_count * cst.APPROX_NODE_BYTES
+
+    def get(self, key, version: int):
+        ftree = self._entries.get(key)
+        if ftree is None:
+            metrics.incr("tree_cache", "misses")
+            return None
+        if ftree.version != version:
+            metrics.incr("tree_cache", "stale")
+            self.evict(key)
+            return None
+
+        self._entries.move_to_end(key)
+        metrics.incr("tree_cache", "hits")
+        return ftree
+
+    def put(self, key, ftree):
+        self.evict(key)
+        size = TreeCache.estimate_bytes(ftree)
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = ftree
+        self._sizes[key] = size
+        self._total_bytes += size
+        while len(self._entries) > self.max_trees or self._total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self.evict(oldest)
+            metrics.incr("tree_cache", "evictions")
+
+    def evict(self, key):
+        if self._entries.pop(key, None) is not None:
+            self._total_bytes -= self._sizes.pop(key)
+
+    def hit_ratio(self) -> Optional[float]:
+        counters = metrics.get("tree_cache")
+        lookups = counters.get("hits", 0) + counters.get("misses", 0) + counters.get("stale", 0)
+        return counters.get("hits", 0) / lookups if lookups > 0 else None
@@ -0,0 +1,248 @@
+"""
+Binary encoding of a Tree for storage. Nodes are written in preorder as flat arrays:
+
+    header        magic, format version, node count, pwd index, link count, names size, links size,
+                  channel count, attachment count, file count
+    channels      u64 per distinct discord channel that files were uploaded to
+    attachments   u64 per file uploaded to discord, its attachment id
+    sizes         u64 per file, its size in bytes or 0 if unknown
+    parents       u32 per node, the index of its parent (0 for the root)
+    name_lens     u32 per node, the length of its name in characters
+    link_ids      u32 per node, 0 for directories, ATTACHMENT_LINK for files uploaded to discord, or
+                  1 + the index of its link in the link table
+    link_lens     u32 per link, the length of each link in characters
+    att_channels  u32 per file uploaded to discord, the index of its channel
+    flags         u8 per node, 1 when the file's link ends in its name and only the prefix is stored
+    names         utf-8 text of every name, concatenated
+    links         utf-8 text of every other distinct link, concatenated
+
+Integers are little-endian. Version 1 has no channel or attachment sections and versions before 3 have no
+sizes. Blobs without the magic are older dill pickles. Compressed blobs start with COMPRESSED_MAGIC and a
+compressor id byte.
+"""
+import gc
+import sys
+import lzma
+import zlib
+import struct
+from array import array
+from typing import Optional
+
+import error
+import constants as cst
+from tree import Node, Tree, _NO_CHILDREN, pack_attachment
+
+MAGIC = b"FBT"
+FORMAT_VERSION = 3
+HEADERS = {
+    1: struct.Struct("<3sBIIIII"),
+    2: struct.Struct("<3sBIIIIIII"),
+    3: struct.Struct("<3sBIIIIIIII"),
+}
+HEADER = HEADERS[FORMAT_VERSION]
+ATTACHMENT_LINK = 0xFFFFFFFF
+
+COMPRESSED_MAGIC = b"FBZ"
+COMPRESSORS = {  # name -> (id stored after COMPRESSED_MAGIC, compress, decompress)
+    "zlib": (1, zlib.compress, zlib.decompress),
+    "lzma": (2, lzma.compress, lzma.decompress),
+}
+
+_ITEM_SIZES = {"I": 4, "Q": 8}
+_NATIVE_LAYOUT = sys.byteorder == "little" and all(array(t).itemsize == n for t, n in _ITEM_SIZES.items())
+
+
+def _int_bytes(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_ints(view: memoryview, offset: int, typecode: str, count: int):
+    chunk = view[offset:offset + _ITEM_SIZES[typecode] * count]
+    if _NATIVE_LAYOUT:
+        return chunk.cast(typecode)
+    return array(typecode, struct.unpack(f"<{count}{typecode}", chunk))
+
+
+def serialize_filetree(ftree: Tree) -> bytes:
+    parents = array("I")
+    name_lens = array("I")
+    link_ids = array("I")
+    flags = bytearray()
+    names = []
+    links = {}  # link -> id
+    channels = {}  # channel id -> index
+    attachment_ids = array("Q")
+    attachment_channels = array("I")
+    sizes = array("Q")
+    pwd_index = 0
+
+    stack = [(ftree.root, 0)]
+    while stack:
+        node, parent_index = stack.pop()
+        index = len(parents)
+        if node is ftree.pwd:
+            pwd_index = index
+        parents.append(parent_index)
+        names.append(node.name)
+        name_lens.append(len(node.name))
+        attachment = node.attachment if not node.is_dir() else None
+        if node.is_dir():
+            link_ids.append(0)
+            flags.append(0)
+        else:
+            sizes.append(node.total_bytes)
+        if attachment is not None:
+            channel_id, attachment_id = attachment
+            link_ids.append(ATTACHMENT_LINK)
+            flags.append(1)
+            attachment_ids.append(attachment_id)
+            attachment_channels.append(channels.setdefault(channel_id, len(channels)))
+        elif not node.is_dir():
+            link_ids.append(links.setdefault(node._link, len(links) + 1))
+            flags.append(node._link_ends_in_name)
+        stack += [(child, index) for child in reversed(node.children)]
+
+    names_text = "".join(names).encode()
+    links_text = "".join(links).encode()
+    link_lens = array("I", [len(link) for link in links])
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(parents), pwd_index, len(links), len(names_text), len(links_text),
+        len(channels), len(attachment_ids), len(sizes)
+    )
+    return b"".join([
+        header,
+        _int_bytes(array("Q", channels)),
+        _int_bytes(attachment_ids),
+        _int_bytes(sizes),
+        _int_bytes(parents),
+        _int_bytes(name_lens),
+        _int_bytes(link_ids),
+        _int_bytes(link_lens),
+        _int_bytes(attachment_channels),
+        bytes(flags),
+        names_text,
+        links_text,
+    ])
+
+
+def _deserialize_legacy(serialized_ftree: bytes) -> Tree:
+    import dill
+    return dill.loads(serialized_ftree)
+
+
+def deserialize_filetree(serialized_ftree: Optional[bytes]) -> Tree:
+    if not serialized_ftree:
+        return Tree()
+    if not serialized_ftree.startswith(MAGIC):
+        return _deserialize_legacy(serialized_ftree)
+
+    view = memoryview(serialized_ftree)
+    version = view[len(MAGIC)]
+    if version not in HEADERS:
+        raise error.UnsupportedTreeFormatError(version)
+    _, _, node_count, pwd_index, link_count, names_size, links_size, *counts = HEADERS[version].unpack_from(view)
+    channel_count, attachment_count = counts[:2] if version >= 2 else (0, 0)
+    file_count = counts[2] if version >= 3 else 0
+
+    offset = HEADERS[version].size
+    sections = {}
+    for name, typecode, count in [
+        ("channels", "Q", channel_count),
+        ("attachment_ids", "Q", attachment_count),
+        ("sizes", "Q", file_count),
+        ("parents", "I", node_count),
+        ("name_lens", "I", node_count),
+        ("link_ids", "I", node_count),
+        ("link_lens", "I", link_count),
+        ("attachment_channels", "I", attachment_count),
+    ]:
+        sections[name] = _read_ints(view, offset, typecode, count)
+        offset += _ITEM_SIZES[typecode] * count
+    flags = view[offset:offset + node_count]
+    offset += node_count
+    names_text = str(view[offset:offset + names_size], "utf-8")
+    offset += names_size
+    links_text = str(view[offset:offset + links_size], "utf-8")
+
+    links = [None]
+    start = 0
+    for length in sections["link_lens"]:
+        links.append(links_text[start:start + length])
+        start += length
+    channels = sections["channels"]
+    attachment_ids = sections["attachment_ids"]
+    attachment_channels = sections["attachment_channels"]
+    sizes = sections["sizes"]
+    parents = sections["parents"]
+    name_lens = sections["name_lens"]
+    link_ids = sections["link_ids"]
+
+    ftree = Tree()
+    nodes = [ftree.root]
+    start = name_lens[0]  # the root is always "/"
+    attachment = 0
+    file = 0
+    # nothing allocated here is garbage, so collections would only cost time
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for i in range(1, node_count):
+            end = start + name_lens[i]
+            parent = nodes[parents[i]]
+            node = Node(names_text[start:end], None, parent=parent)
+            start = end
+            link_id = link_ids[i]
+            if link_id == ATTACHMENT_LINK:
+                node._link = pack_attachment(channels[attachment_channels[attachment]], attachment_ids[attachment])
+                node._link_ends_in_name = True
+                node._children = _NO_CHILDREN
+                attachment += 1
+            elif link_id != 0:
+                # version 1 stores discord links as text, which the setter turns into ids
+                node.link = links[link_id] + node.name if flags[i] else links[link_id]
+                node._children = _NO_CHILDREN
+            if link_id != 0:
+                node.file_count = 1
+                node.total_bytes = sizes[file] if file < len(sizes) else 0
+                file += 1
+            parent._append_child(node)
+            nodes.append(node)
+
+        # backwards through preorder, children come before their parents
+        for i in range(node_count - 1, 0, -1):
+            node = nodes[i]
+            parent = node._parent
+            parent.file_count += node.file_count
+            parent.total_bytes += node.total_bytes
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    ftree.node_count = node_count
+    ftree.pwd = nodes[pwd_index]
+    return ftree
+
+
+def compress_blob(blob: bytes, compression: Optional[str], min_bytes: int = cst.COMPRESSION_MIN_BYTES) -> bytes:
+    if compression is None or len(blob) < min_bytes:
+        return blob
+    compressor_id, compress, _ = COMPRESSORS[compression]
+    compressed = COMPRESSED_MAGIC + bytes([compressor_id]) + compress(blob)
+    return compressed if len(compressed) < len(blob) else blob
+
+
+def is_compressed(blob: Optional[bytes]) -> bool:
+    return blob is not None and blob.startswith(COMPRESSED_MAGIC)
+
+
+def decompress_blob(blob: Optional[bytes]) -> Optional[bytes]:
+    if not is_compressed(blob):
+        return blob
+    compressor_id = blob[len(COMPRESSED_MAGIC)]
+    for known_id, _, decompress in COMPRESSORS.values():
+        if known_id == compressor_id:
+            return decompress(memoryview(blob)[len(COMPRESSED_MAGIC) + 1:])
+    raise error.UnsupportedTreeFormatError(compressor_id)
@@ -21,8 +21,10 @@ HELP_STRINGS = {
     "folderbot": "**folderbot** is a pseudo-filesystem for Discord servers that keeps track of attachments in "
                  "directories. It maintains a separate file tree for each server and supports the unix-style commands "
                  "shown below. Relative filepaths are also supported.",
-    "tree": "**>>tree**\n"
-            "prints the full file tree",
+    "tree": "**>>tree** [*path*] [*-L depth*] [*-f*]\n"
+            "prints the file tree under *path*, or the full tree if *path* is not specified. *-L* only shows "
+            "*depth* levels below it. Large trees are split over several messages; with *-f* the tree is "
+            "attached as a text file instead",
     "pwd": "**>>pwd**\n"
            "shows the __**p**__resent __**w**__orking __**d**__irectory",
     "ls": "**>>ls** [*path*]\n"
@@ -30,20 +32,58 @@ HELP_STRINGS = {
           "contents of current directory",
     "cd": "**>>cd** [*path*]\n"
           "__**c**__hanges __**d**__irectory to the one specified by *path*. If *path* is not specified, "
-          "changes to root directory",
+          "changes to root directory. Every user has their own current directory",
     "mk": "**>>mk** path1 [*path2* *path3* ...]\n"
           "__**m**__a__**k**__es the directories specified by the (space separated) *path*s",
     "rm": "**>>rm** path1 [*path2* *path3* ...]\n"
-          "__**r**__e__**m**__oves all the files/directories located at the (space separated) *path*s",
+          "__**r**__e__**m**__oves all the files/directories located at the (space separated) *path*s. A *path* "
+          "can match many with \\*, ? and [...] in any of its names, and \\*\\* for any number of directories",
     "up": "**>>up** *path*\n"
           "__**up**__loads the attachments in the message to the directory pointed to by *path*. If *path* is not "
-          "specified, attachments are uploaded to the current directory"
+          "specified, attachments are uploaded to the current directory",
+    "du": "**>>du** [*path*]\n"
+          "shows how many files are in the directory at *path* and below it, and their total size. If *path* "
+          "is not specified, shows the current directory",
+    "find": "**>>find** *pattern* [*path*]\n"
+            "__**find**__s the files and folders under *path* (or everywhere) whose names contain *pattern*, "
+            "ignoring case. *pattern* may also be a glob using \\*, ? and [...], such as \\*.png",
+    "stats": "**>>stats**\n"
+             "shows the bot's internal counters, such as how many saves were written or skipped per command"
 }
 
+# Embed limits
+EMBED_DESCRIPTION_LIMIT = 4096
+MAX_EMBED_PAGES = 5
+ELLIPSIS = "…"
+TREE_FILE_NAME = "tree.txt"
+TREE_FILE_FLAG = "-f"
+TREE_DEPTH_FLAG = "-L"
+
 # Logic
-COMMANDS = ["up", "tree", "mk", "rm", "ls", "lsa"]
+COMMANDS = ["up", "tree", "mk", "rm", "ls", "lsa", "du", "find", "stats"]
 NEWLINE = "\n"
 PREV_DIR_SYM = ".."
 CUR_DIR_SYM = "."
 ALL_ITEMS_SYM = "*"
+RENAMED_DIR_SUFFIX = " (folder)"  # added to a folder loaded from an old tree next to a file with its name
+ANY_DEPTH_SYM = "**"
+GLOB_CHARS = "*?["
 LS_GRID_COLS = 4
+BYTE_UNITS = ["B", "KB", "MB", "GB", "TB"]
+GLOB_MAX_MATCHES = 1000  # more than any one command should touch by accident
+FIND_MAX_RESULTS = 250  # a little more than fits in MAX_EMBED_PAGES, so long results are cut short
+
+# Links
+ATTACHMENT_URL = "https://cdn.discordapp.com/attachments/"
+SNOWFLAKE_BITS = 64
+
+# Caching
+APPROX_NODE_BYTES = 400
+PATH_PLAN_CACHE_SIZE = 1024
+
+# Storage
+SAVE_RETRIES = 5
+OPLOG_MAX_OPS = 500  # ops appended after a snapshot before the next one is written
+OPLOG_MAX_BYTES = 64 * 1024
+COMPRESSION_MIN_BYTES = 4 * 1024  # smaller snapshots are stored as they are
+SESSION_TTL = 7 * 24 * 60 * 60  # seconds a user's pwd is kept without being used
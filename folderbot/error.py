@@ -75,6 +75,48 @@ class InvalidFilepathError(FolderbotError):
         super(InvalidFilepathError, self).__init__(message)
 
 
+class InvalidOptionError(FolderbotError):
+    def __init__(self, option: str, reason: str):
+        message = f"Bad option {option} : {reason}"
+        super(InvalidOptionError, self).__init__(message)
+
+
+class VersionConflictError(FolderbotError):
+    def __init__(self, version: int):
+        message = f"File tree was saved elsewhere after it was loaded at version {version}"
+        super(VersionConflictError, self).__init__(message)
+
+
+class ConcurrentModificationError(FolderbotError):
+    def __init__(self):
+        message = f"The file tree is being changed by too many commands at once, please try again"
+        super(ConcurrentModificationError, self).__init__(message)
+
+
+class UnsupportedTreeFormatError(FolderbotError):
+    def __init__(self, version: int):
+        message = f"Stored file tree uses format version {version}, which this version of the bot cannot read"
+        super(UnsupportedTreeFormatError, self).__init__(message)
+
+
+class DirectoryNotLoadedError(FolderbotError):
+    def __init__(self):
+        message = f"Folder contents were not loaded from storage"
+        super(DirectoryNotLoadedError, self).__init__(message)
+
+
+class CannotFindError(FolderbotError):
+    def __init__(self, filepath: str):
+        message = f"Cannot search under {filepath}: is not a directory"
+        super(CannotFindError, self).__init__(message)
+
+
+class NoPatternProvidedError(FolderbotError):
+    def __init__(self, cmd: str):
+        message = f"No pattern provided for {cmd}"
+        super(NoPatternProvidedError, self).__init__(message)
+
+
 if __name__ == '__main__':  # pragma: no cover
     e = CdPreviousFromRootError()
     print(isinstance(e, CdPreviousFromRootError))
@@ -0,0 +1,20 @@
+from collections import Counter, defaultdict
+from typing import Dict
+
+_counters = defaultdict(Counter)
+
+
+def incr(group: str, name: str, amount: int = 1):
+    _counters[group][name] += amount
+
+
+def get(group: str) -> Dict[str, int]:
+    return dict(_counters[group])
+
+
+def groups() -> Dict[str, Dict[str, int]]:
+    return {group: dict(counter) for group, counter in _counters.items()}
+
+
+def reset():
+    _counters.clear()
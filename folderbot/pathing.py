@@ -1,26 +1,183 @@
+from collections import OrderedDict
 from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from typing import Iterator, Optional, Tuple
 
 import util
 import error
+import metrics
 import constants as cst
+from util import PathLike, TreePath
 
 
-def get_required_parent_dirs_for_mk(filetree, abs_path: str) -> [str]:
-    cur_filepath = ""
-    required_dirs = []
-    for i, name in enumerate(abs_path.split("/")):
-        cur_filepath += f"/{name}"
-        try:
-            filetree.get_node_from_path(cur_filepath)
-        except error.NodeDoesNotExistError:
-            required_dirs.append(util.clean_path(cur_filepath))
+def get_required_parent_dirs_for_mk(filetree, abs_path: PathLike) -> [str]:
+    names = TreePath.parse(abs_path)
+    node = filetree.root
+    depth = 0
+    while depth < len(names):
+        node = node.get_child(names[depth])
+        if node is None:
+            break
+        depth += 1
 
-    return required_dirs
+    return [str(TreePath(names[:i + 1])) for i in range(depth, len(names))]
+
+
+@dataclass(frozen=True)
+class PlanStep:
+    path: str  # absolute path or pattern of the nodes to look up, named in errors
+    ups: Optional[int]  # levels to climb from the pwd before descending, or None to start at the root
+    components: Tuple[str, ...]  # names or patterns to descend through after that
+    is_glob: bool  # some component is a pattern, so the step can match any number of nodes
+
+
+@dataclass(frozen=True)
+class PathPlan:
+    """
+    What a path given to a command resolves to from a particular pwd. A plan only depends on the pwd path
+    and the text of the path, never on the rest of the tree, so it stays valid however the tree changes.
+    """
+    path: str  # the absolute path as typed, named in errors
+    paths: Tuple[TreePath, ...]
+    steps: Tuple[PlanStep, ...]
+    is_relative: bool
+
+    def resolve(self, filetree, limit: int = cst.GLOB_MAX_MATCHES) -> list:
+        target_nodes = []
+        for i, step in enumerate(self.steps):
+            nodes = _glob(filetree, step, limit) if step.is_glob else [_walk(filetree, step)]
+            # a relative path with .. in it starts with the pwd itself, which is not a target
+            if not (self.is_relative and i == 0 and len(self.steps) > 1):
+                target_nodes += nodes
+        return target_nodes
+
+
+def _is_pattern(name: str) -> bool:
+    return any(c in name for c in cst.GLOB_CHARS)
+
+
+def _start(filetree, step: PlanStep):
+    node = filetree.root
+    if step.ups is not None:
+        node = filetree.pwd
+        for _ in range(step.ups):
+            node = node.parent
+    return node
+
+
+def _walk(filetree, step: PlanStep):
+    node = _start(filetree, step)
+    for name in step.components:
+        node = node.get_child(name)
+        if node is None:
+            raise error.NodeDoesNotExistError(step.path)
+    return node
+
+
+def _descendants(node, dirs_only: bool) -> Iterator:
+    def below(parent) -> list:
+        children = reversed(parent.children)
+        return [child for child in children if child.is_dir()] if dirs_only else list(children)
+
+    stack = below(node)
+    while stack:
+        node = stack.pop()
+        if node.is_dir():
+            stack += below(node)
+        yield node
+
+
+def _expand(nodes: Iterator, component: str, is_last: bool) -> Iterator:
+    for node in nodes:
+        if component == cst.ANY_DEPTH_SYM:
+            # at the end, everything below the node
+            if not is_last:
+                yield node
+            yield from _descendants(node, dirs_only=not is_last)
+            continue
+        child = node.get_child(component)
+        if child is not None:
+            yield child  # names that happen to contain glob characters still match themselves
+        elif _is_pattern(component):
+            yield from (child for child in node.children if fnmatchcase(child.name, component))
+
+
+def _glob(filetree, step: PlanStep, limit: int) -> list:
+    """
+    Matches step's components one level at a time, looking literal names up directly so that the walk only
+    fans out at patterns. Raises as soon as more than limit nodes match.
+    """
+    nodes = iter([_start(filetree, step)])
+    for i, component in enumerate(step.components):
+        nodes = _expand(nodes, component, i == len(step.components) - 1)
+
+    matches = {}  # ** can reach a node more than once
+    for node in nodes:
+        matches[node] = None
+        if len(matches) > limit:
+            raise error.InvalidFilepathError(step.path, f"Matches more than {limit} files or folders")
+    if len(matches) == 0:
+        raise error.NodeDoesNotExistError(step.path)
+    metrics.incr("globs", "matches", len(matches))
+    return list(matches)
+
+
+def _plan_step(pwd_names: TreePath, path: str) -> PlanStep:
+    names = TreePath.parse(path)
+    is_glob = any(_is_pattern(name) for name in names)
+
+    common = 0
+    while common < min(len(names), len(pwd_names)) and names[common] == pwd_names[common]:
+        common += 1
+    ups = len(pwd_names) - common
+    # climbing from the pwd only pays off when the shared part is longer than the climb
+    if ups < common:
+        return PlanStep(path, ups, tuple(names[common:]), is_glob)
+    return PlanStep(path, None, tuple(names), is_glob)
+
+
+class PathPlanCache:
+    """Bounded LRU of PathPlans keyed by (pwd path, path as typed, is_mk_cmd)."""
+    max_plans: int
+
+    def __init__(self, max_plans: int):
+        self.max_plans = max_plans
+        self._plans = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def get(self, pwd_path: str, rel_path: str, is_mk_cmd: bool) -> PathPlan:
+        key = (pwd_path, rel_path, is_mk_cmd)
+        plan = self._plans.get(key)
+        if plan is not None:
+            self._plans.move_to_end(key)
+            metrics.incr("path_plans", "hits")
+            return plan
+
+        metrics.incr("path_plans", "misses")
+        plan = Filepaths.compile(pwd_path, rel_path, is_mk_cmd)
+        self._plans[key] = plan
+        if len(self._plans) > self.max_plans:
+            self._plans.popitem(last=False)
+        return plan
+
+    def clear(self):
+        self._plans.clear()
+
+    @staticmethod
+    def hit_ratio() -> Optional[float]:
+        counters = metrics.get("path_plans")
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return counters.get("hits", 0) / lookups if lookups > 0 else None
+
+
+plan_cache = PathPlanCache(cst.PATH_PLAN_CACHE_SIZE)
 
 
 @dataclass
 class Filepaths:
-    _paths: [str]
+    _paths: [TreePath]
     _target_nodes: []
     _is_mk_cmd: bool
 
@@ -30,12 +187,16 @@ class Filepaths:
             yield item
 
     def __repr__(self) -> str:
+        return str(self._paths[-1])
+
+    def get_path(self) -> TreePath:
         return self._paths[-1]
 
     def __init__(self, filetree, rel_path: str, is_mk_cmd: bool = False):
-        self._target_nodes = []
         self._is_mk_cmd = is_mk_cmd
-        self._paths = list(map(util.clean_path, self._build_paths(filetree, util.clean_path(rel_path))))
+        plan = plan_cache.get(filetree.get_pwd_path(), rel_path, is_mk_cmd)
+        self._paths = list(plan.paths)
+        self._target_nodes = [] if is_mk_cmd else plan.resolve(filetree)
 
     def get_target_nodes(self) -> []:
         return self._paths if self._is_mk_cmd else self._target_nodes
@@ -67,12 +228,12 @@ class Filepaths:
 
         return endpoints
 
-    def _build_paths(self, filetree, path: str) -> [str]:
-        path = util.clean_path(path)
+    @staticmethod
+    def compile(pwd_path: str, rel_path: str, is_mk_cmd: bool) -> PathPlan:
+        path = util.clean_path(rel_path)
         is_relative = False if path[0] == "/" else True
         if is_relative:
-            pwd = filetree.get_pwd_path()
-            path = util.clean_path(f"{pwd}/{path}")
+            path = util.clean_path(f"{pwd_path}/{path}")
 
         path_list = path.split("/")
         endpoints = []
@@ -85,13 +246,11 @@ class Filepaths:
                 cur_working_plist += plist
                 if cd_count > len(cur_working_plist):
                     raise error.CdPreviousFromRootError()
-                # print(f"plist: {plist}, cwp: {cur_working_plist}, chopping off the last {cd_count} items")
                 cur_working_plist = plist[: -cd_count]
             else:
                 cur_working_plist += plist
                 if cd_count > len(cur_working_plist):
                     raise error.CdPreviousFromRootError()
-                # print(f"plist: {plist}, cwp: {cur_working_plist}, chopping off the last {cd_count} items")
                 endpoints.append(cur_working_plist)
                 cur_working_plist = cur_working_plist[:-cd_count]
 
@@ -100,29 +259,19 @@ class Filepaths:
         if final_cd_count > 0:
             endpoints.append(cur_working_plist)
 
-        endpoints_str = []
-        endpoints = list(dict.fromkeys([util.clean_path(f"/{'/'.join(plist)}") for plist in endpoints]))
-        for full_path in endpoints:
-            if not self._is_mk_cmd:
-                if cst.ALL_ITEMS_SYM in full_path and full_path[-1] != cst.ALL_ITEMS_SYM:
-                    raise error.InvalidFilepathError(path, f"Cannot use {cst.ALL_ITEMS_SYM} "
-                                                           f"as a directory name")
-                if full_path[-1] == cst.ALL_ITEMS_SYM:
-                    node = filetree.get_node_from_path(full_path[:-2])
-                    for child in node.children:
-                        self._target_nodes.append(child)
-                else:
-                    node = filetree.get_node_from_path(full_path)
-                    self._target_nodes.append(node)
-            else:
+        pwd_names = TreePath.parse(pwd_path)
+        endpoints = list(dict.fromkeys([TreePath(plist) for plist in endpoints]))
+        steps = []
+        for endpoint in endpoints:
+            full_path = str(endpoint)
+            if is_mk_cmd:
                 if cst.ALL_ITEMS_SYM in full_path:
                     raise error.InvalidFilepathError(path, f"Cannot use {cst.ALL_ITEMS_SYM} "
                                                            f"as a directory name")
-            endpoints_str.append(full_path)
+            else:
+                steps.append(_plan_step(pwd_names, full_path))
 
-        if is_relative and len(self._target_nodes) > 1:
-            self._target_nodes = self._target_nodes[1:]
-        return endpoints_str
+        return PathPlan(path, tuple(endpoints), tuple(steps), is_relative)
 
 
 if __name__ == '__main__':  # pragma: no cover
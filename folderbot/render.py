@@ -0,0 +1,90 @@
+from itertools import islice
+from typing import Iterable, Iterator
+
+import constants as cst
+
+BRANCH_PREFIX = cst.PIPE + cst.SPACE[1:]  # drawn under an ancestor that still has siblings below it
+
+
+def format_bytes(count: int) -> str:
+    size = float(count)
+    for unit in cst.BYTE_UNITS[:-1]:
+        if size < 1024:
+            return f"{count} {unit}" if unit == cst.BYTE_UNITS[0] else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} {cst.BYTE_UNITS[-1]}"
+
+
+def format_usage(node) -> str:
+    if not node.is_dir():
+        return format_bytes(node.total_bytes)
+    files = "1 file" if node.file_count == 1 else f"{node.file_count} files"
+    return f"{files}, {format_bytes(node.total_bytes)}"
+
+
+def format_node(ftree, node) -> str:
+    if node.is_dir():
+        name = f"__**{node.name}**__" if ftree.pwd is node else node.name
+        node_str_rep = f"{cst.FOLDER_OPEN} {name}"
+        if node.is_leaf():
+            node_str_rep = f"{node_str_rep} *(empty)*"
+        return node_str_rep
+    return f"[{node.name}]({node.link})"
+
+
+def format_find_result(node) -> str:
+    if node.is_dir():
+        return f"{cst.FOLDER_OPEN} {node.get_full_path()}"
+    return f"[{node.get_full_path()}]({node.link})"
+
+
+def iter_tree_lines(ftree, start=None, max_depth: int = None) -> Iterator[str]:
+    """Yields the >>tree lines for the subtree at start, down to max_depth levels below it."""
+    prefixes = [cst.SPACE]  # prefixes[d] is drawn in front of every node at depth d + 1
+    for node, depth, is_last in ftree.walk(start, max_depth):
+        if depth == 0:
+            yield format_node(ftree, node)
+            continue
+
+        prefix = prefixes[depth - 1]
+        pipe = cst.PIPE_END if is_last else cst.PIPE_SIDE
+        yield f"{prefix}{pipe} {format_node(ftree, node)}"
+        if not node.is_leaf():
+            del prefixes[depth:]
+            prefixes.append(prefix + (cst.SPACE if is_last else BRANCH_PREFIX))
+
+
+def iter_ls_lines(node, cols: int = cst.LS_GRID_COLS) -> Iterator[str]:
+    children = iter(node.children)
+    batch = list(islice(children, cols))
+    if len(batch) == 0:
+        yield "*(empty)*"
+    while len(batch) > 0:
+        line = ""
+        for child in batch:
+            if child.is_dir():
+                line += f"{cst.FOLDER_OPEN}{child.name} *({format_usage(child)})*{cst.SPACE}"
+            elif child.total_bytes > 0:
+                line += f"[{child.name}]({child.link}) *({format_usage(child)})*{cst.SPACE}"
+            else:
+                line += f"[{child.name}]({child.link}){cst.SPACE}"
+        yield line
+        batch = list(islice(children, cols))
+
+
+def paginate(lines: Iterable[str], limit: int = cst.EMBED_DESCRIPTION_LIMIT) -> Iterator[str]:
+    """Packs lines into pages of at most limit characters. A line too long on its own is cut short."""
+    page = []
+    page_len = 0  # length of the page joined with newlines, plus the newline before the next line
+    for line in lines:
+        if len(line) > limit:
+            line = f"{line[:limit - len(cst.ELLIPSIS)]}{cst.ELLIPSIS}"
+        if len(page) > 0 and page_len + len(line) > limit:
+            yield cst.NEWLINE.join(page)
+            page = []
+            page_len = 0
+        page.append(line)
+        page_len += len(line) + len(cst.NEWLINE)
+
+    if len(page) > 0:
+        yield cst.NEWLINE.join(page)
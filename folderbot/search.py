@@ -0,0 +1,137 @@
+"""
+Name search for >>find, through an index of the words in node names that each tree keeps once searched.
+"""
+import re
+import gc
+import heapq
+from fnmatch import fnmatchcase
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import metrics
+import constants as cst
+
+_WORD_SEP = re.compile(r"[\W_]+")  # words in names are runs of letters and digits
+_WORD = re.compile(r"[^\W_]+")
+_GLOB_CHARS = re.compile(r"[*?]|\[[^\]]*\]?")
+_EXTENSION_GLOB = re.compile(r"\*\.([^\W_]+)")
+EXTENSION_KEY = "."  # prefixes extension keys, which no word can start with
+
+
+def name_keys(node) -> List[str]:
+    name = node.name.lower()
+    keys = _WORD.findall(name)
+    # the extension is the last word when it comes right after a dot, so that exactly the names matching
+    # *.ext have it, folders and names like ".png" included
+    if len(keys) > 0 and name.endswith(f".{keys[-1]}"):
+        keys.append(EXTENSION_KEY + keys[-1])
+    return keys
+
+
+class NameIndex:
+    """Lowercased words and extensions in node names -> nodes. Updates are ignored until it is built."""
+
+    def __init__(self):
+        self._postings: Optional[Dict[str, Dict[object, None]]] = None  # key -> nodes, as an ordered set
+
+    def __len__(self) -> int:
+        return len(self._postings) if self._postings is not None else 0
+
+    def is_built(self) -> bool:
+        return self._postings is not None
+
+    def build(self, nodes: Iterable):
+        self._postings = {}
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.add(nodes)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        metrics.incr("find", "index_builds")
+
+    def add(self, nodes: Iterable):
+        if self._postings is None:
+            return
+        postings = self._postings
+        for node in nodes:
+            for key in name_keys(node):
+                nodes_with_key = postings.get(key)
+                if nodes_with_key is None:
+                    nodes_with_key = postings[key] = {}
+                nodes_with_key[node] = None
+
+    def remove(self, nodes: Iterable):
+        if self._postings is None:
+            return
+        for node in nodes:
+            for key in name_keys(node):
+                postings = self._postings.get(key)
+                if postings is not None:
+                    postings.pop(node, None)
+                    if len(postings) == 0:
+                        del self._postings[key]
+
+    def with_extension(self, extension: str) -> Iterable:
+        return self._postings.get(EXTENSION_KEY + extension, {}).keys()
+
+    def with_word_containing(self, text: str) -> Iterable:
+        """Nodes with a word that contains text."""
+        found = {}
+        for key, postings in self._postings.items():
+            if text in key and not key.startswith(EXTENSION_KEY):
+                found.update(postings)
+        return found.keys()
+
+
+def _candidates(ftree, pattern: str, is_glob: bool) -> Optional[Iterable]:
+    # nodes that can match pattern, or None if the index cannot narrow them down
+    if is_glob:
+        extension = _EXTENSION_GLOB.fullmatch(pattern)
+        if extension is not None:
+            return ftree.name_index().with_extension(extension.group(1))
+    # a literal run of letters and digits in the pattern always falls within one word of a matching name
+    words = [word for word in _WORD_SEP.split(_GLOB_CHARS.sub(" ", pattern)) if word]
+    if len(words) == 0:
+        return None
+    return ftree.name_index().with_word_containing(max(words, key=len))
+
+
+def _is_under(node, start) -> bool:
+    if start.parent is None:
+        return True
+    return node.get_full_path().startswith(f"{start.get_full_path()}/")
+
+
+def find_nodes(ftree, pattern: str, start=None, limit: int = cst.FIND_MAX_RESULTS) -> Iterator:
+    """
+    Yields up to limit nodes below start whose names match pattern, ignoring case. Globs match the whole
+    name, other patterns any part of it. Indexed matches are ranked exact first, then by prefix and depth;
+    patterns without letters or digits scan the subtree in tree order.
+    """
+    pattern = pattern.lower()
+    start = start or ftree.root
+    is_glob = _GLOB_CHARS.search(pattern) is not None
+
+    def matches(node) -> bool:
+        name = node.name.lower()
+        return fnmatchcase(name, pattern) if is_glob else pattern in name
+
+    candidates = _candidates(ftree, pattern, is_glob)
+    if candidates is None:
+        metrics.incr("find", "scans")
+        found = (node for node, _, _ in ftree.walk(start) if node is not start and matches(node))
+        for i, node in enumerate(found):
+            if i == limit:
+                return
+            yield node
+        return
+
+    metrics.incr("find", "index_lookups")
+    found = [node for node in candidates if matches(node) and _is_under(node, start)]
+    yield from heapq.nsmallest(limit, found, key=lambda node: (
+        node.name.lower() != pattern,
+        not node.name.lower().startswith(pattern),
+        node.get_depth(),
+        node.get_full_path(),
+    ))
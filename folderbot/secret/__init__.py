@@ -1,5 +1,6 @@
 import os
 import json
+from typing import Optional
 
 
 def get_discord_token() -> str:
@@ -17,5 +18,42 @@ def get_redis_url() -> str:
     return os.getenv('REDISTOGO_URL', 'redis://localhost:7777')
 
 
+def get_redis_pool_size() -> int:
+    return int(os.getenv("FOLDERBOT_REDIS_POOL_SIZE", "10"))
+
+
+def get_redis_timeout() -> float:
+    return float(os.getenv("FOLDERBOT_REDIS_TIMEOUT", "5"))
+
+
+def get_redis_pool_timeout() -> float:
+    return float(os.getenv("FOLDERBOT_REDIS_POOL_TIMEOUT", "10"))
+
+
 def is_production() -> bool:
     return os.getenv("DISCORD_TOKEN", None) is not None
+
+
+def get_storage_backend() -> str:
+    return os.getenv("FOLDERBOT_STORAGE", "snapshot")
+
+
+def get_tree_cache_size() -> int:
+    return int(os.getenv("FOLDERBOT_CACHE_TREES", "128"))
+
+
+def get_tree_cache_bytes() -> int:
+    return int(os.getenv("FOLDERBOT_CACHE_MB", "256")) * 1024 * 1024
+
+
+def get_tree_compression() -> Optional[str]:
+    compression = os.getenv("FOLDERBOT_COMPRESSION", "none")
+    return None if compression == "none" else compression
+
+
+def get_compression_min_bytes() -> int:
+    return int(os.getenv("FOLDERBOT_COMPRESSION_MIN_BYTES", "4096"))
+
+
+def get_session_ttl() -> int:
+    return int(os.getenv("FOLDERBOT_SESSION_TTL", "604800"))
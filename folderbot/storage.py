@@ -0,0 +1,634 @@
+import time
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import WatchError
+from discord.ext.commands.context import Context
+
+import error
+import metrics
+import constants as cst
+from cache import TreeCache
+from tree import Node, Tree, _UNLOADED
+from util import TreePath
+from pathing import plan_cache
+from codec import compress_blob, decompress_blob, is_compressed, serialize_filetree, deserialize_filetree
+
+DIR_RECORD = "d"
+FILE_RECORD = "f"
+RECORD_SEP = "|"
+TOTALS_FIELD = "/"  # prefixes the field holding a child directory's totals, which no name can start with
+OP_SEP = " "
+SIZE_SEP = ":"
+
+_last_seq = 0
+
+
+def _next_seq() -> int:
+    # wall clock based so that children added by different workers still sort in insertion order
+    global _last_seq
+    _last_seq = max(time.time_ns(), _last_seq + 1)
+    return _last_seq
+
+
+def _encode_record(node: Node) -> str:
+    if node.is_dir():
+        return f"{_next_seq()}{RECORD_SEP}{DIR_RECORD}"
+    return f"{_next_seq()}{RECORD_SEP}{FILE_RECORD}{node.total_bytes}{RECORD_SEP}{node.link}"
+
+
+def _decode_record(record: str) -> Tuple[int, str, Optional[str], int]:
+    # files recorded before sizes were kept have a bare FILE_RECORD kind
+    seq, kind, *link = record.split(RECORD_SEP, 2)
+    return int(seq), kind[0], link[0] if link else None, int(kind[1:] or 0)
+
+
+def _encode_totals(node: Node) -> str:
+    return f"{node.file_count}{RECORD_SEP}{node.total_bytes}"
+
+
+def _decode_totals(totals: str) -> Tuple[int, int]:
+    file_count, total_bytes = totals.split(RECORD_SEP)
+    return int(file_count), int(total_bytes)
+
+
+def _subtree_dir_paths(node: Node) -> List[str]:
+    paths = []
+    stack = [node]
+    while stack:
+        cur = stack.pop()
+        if cur.is_dir():
+            paths.append(cur.get_full_path())
+            stack += cur.children
+    return paths
+
+
+def connect(url: str, max_connections: int, timeout: float, pool_timeout: float, **connection_kwargs) -> Redis:
+    # commands from other guilds wait up to pool_timeout for a free connection instead of failing at once
+    pool = BlockingConnectionPool.from_url(
+        url, max_connections=max_connections, timeout=pool_timeout, socket_timeout=timeout,
+        socket_connect_timeout=timeout, **connection_kwargs
+    )
+    return Redis(connection_pool=pool)
+
+
+def _decode_version(version: Optional[bytes]) -> int:
+    return int(version) if version is not None else 0
+
+
+async def _watch_version(pipe, version_key: str, expected: int):
+    # the tree being saved must have been loaded at the version that is stored now
+    await pipe.watch(version_key)
+    stored = _decode_version(await pipe.get(version_key))
+    if stored != expected:
+        await pipe.reset()
+        raise error.VersionConflictError(expected)
+
+
+async def _execute_watched(pipe, expected: int) -> list:
+    try:
+        return await pipe.execute()
+    except WatchError:
+        raise error.VersionConflictError(expected)
+
+
+def _cpu_us(start_ns: int) -> int:
+    return (time.process_time_ns() - start_ns) // 1000
+
+
+def _encode_op(op: str, node: Node) -> str:
+    # the path goes last and the link is preceded by its length, since both may contain the separator
+    if op == "mk" and not node.is_dir():
+        return OP_SEP.join(["up", f"{len(node.link)}{SIZE_SEP}{node.total_bytes}", node.link, node.get_full_path()])
+    return OP_SEP.join([op, node.get_full_path()])
+
+
+def _replay_op(ftree: Tree, record: str):
+    op, rest = record.split(OP_SEP, 1)
+    if op == "mk":
+        ftree.create_node(rest, is_file=False, link=None)
+    elif op == "up":
+        lengths, rest = rest.split(OP_SEP, 1)
+        link_len, _, size = lengths.partition(SIZE_SEP)  # ops logged before sizes were kept have no size
+        link_len = int(link_len)
+        ftree.create_node(rest[link_len + 1:], is_file=True, link=rest[:link_len], size=int(size or 0))
+    elif op == "rm":
+        ftree.destroy_node(rest)
+    # logs written while the pwd was kept in the tree may still hold cd ops, which no longer mean anything
+
+
+class SnapshotStore:
+    """
+    Keeps each guild's tree as a snapshot plus a log of the ops applied since. A new snapshot is only written
+    once the log grows past max_log_ops or max_log_bytes.
+    """
+    database: Redis
+
+    def __init__(
+            self,
+            database: Redis,
+            max_log_ops: int = cst.OPLOG_MAX_OPS,
+            max_log_bytes: int = cst.OPLOG_MAX_BYTES,
+            compression: Optional[str] = None,
+            compression_min_bytes: int = cst.COMPRESSION_MIN_BYTES,
+    ):
+        self.database = database
+        self.max_log_ops = max_log_ops
+        self.max_log_bytes = max_log_bytes
+        self.compression = compression
+        self.compression_min_bytes = compression_min_bytes
+
+    @staticmethod
+    def _version_key(server_id) -> str:
+        return f"{server_id}:version"
+
+    @staticmethod
+    def _log_key(server_id) -> str:
+        return f"{server_id}:log"
+
+    async def get_version(self, context: Context) -> int:
+        return _decode_version(await self.database.get(self._version_key(context.message.guild.id)))
+
+    async def load(self, context: Context) -> Tree:
+        server_id = context.message.guild.id
+        pipe = self.database.pipeline(transaction=True)
+        pipe.get(server_id)
+        pipe.lrange(self._log_key(server_id), 0, -1)
+        pipe.get(self._version_key(server_id))
+        serialized_ftree, log, version = await pipe.execute()
+        if is_compressed(serialized_ftree):
+            start = time.process_time_ns()
+            serialized_ftree = decompress_blob(serialized_ftree)
+            metrics.incr("compression", f"{server_id}.loads")
+            metrics.incr("compression", f"{server_id}.decompress_us", _cpu_us(start))
+        ftree = deserialize_filetree(serialized_ftree)
+        for record in log:
+            _replay_op(ftree, record.decode())
+        ftree.mark_clean()
+        ftree.version = _decode_version(version)
+        ftree.log_ops = len(log)
+        ftree.log_bytes = sum(len(record) for record in log)
+        return ftree
+
+    async def load_paths(self, context: Context, paths: Iterable[TreePath]) -> Tree:
+        # a snapshot can only be read whole
+        return await self.load(context)
+
+    async def save(self, context: Context, ftree: Tree) -> bool:
+        if not ftree.is_dirty():
+            return False
+
+        server_id = context.message.guild.id
+        version_key = self._version_key(server_id)
+        log_key = self._log_key(server_id)
+        records = [_encode_op(op, node).encode() for op, node in ftree.journal]
+        log_ops = ftree.log_ops + len(records)
+        log_bytes = ftree.log_bytes + sum(len(record) for record in records)
+        compact = log_ops > self.max_log_ops or log_bytes > self.max_log_bytes
+        snapshot = self._compress_snapshot(server_id, serialize_filetree(ftree)) if compact else None
+        async with self.database.pipeline(transaction=True) as pipe:
+            await _watch_version(pipe, version_key, ftree.version)
+            pipe.multi()
+            if compact:
+                pipe.set(server_id, snapshot)
+                pipe.delete(log_key)
+            else:
+                pipe.rpush(log_key, *records)
+            pipe.incr(version_key)
+            ftree.version = (await _execute_watched(pipe, ftree.version))[-1]
+
+        ftree.mark_clean()
+        if compact:
+            ftree.log_ops = ftree.log_bytes = 0
+            metrics.incr("oplog", "compactions")
+        else:
+            ftree.log_ops, ftree.log_bytes = log_ops, log_bytes
+            metrics.incr("oplog", "appended", len(records))
+        return True
+
+    def _compress_snapshot(self, server_id, snapshot: bytes) -> bytes:
+        if self.compression is None:
+            return snapshot
+        start = time.process_time_ns()
+        stored = compress_blob(snapshot, self.compression, self.compression_min_bytes)
+        metrics.incr("compression", f"{server_id}.snapshots")
+        metrics.incr("compression", f"{server_id}.compress_us", _cpu_us(start))
+        metrics.incr("compression", f"{server_id}.raw_bytes", len(snapshot))
+        metrics.incr("compression", f"{server_id}.stored_bytes", len(stored))
+        return stored
+
+
+class NodeStore:
+    """
+    Keeps one redis hash per directory, mapping child names to records, plus a sorted set of directory paths.
+    Saves only write the fields the journal touched. Each hash also holds its child directories' totals
+    under TOTALS_FIELD + name, so that unloaded directories still know them.
+    """
+    database: Redis
+
+    def __init__(self, database: Redis):
+        self.database = database
+
+    @staticmethod
+    def _key(server_id, *parts) -> str:
+        return ":".join(["folderbot", str(server_id), *parts])
+
+    def _dir_key(self, server_id, path: str) -> str:
+        return self._key(server_id, "dir", path)
+
+    async def _descendant_dir_paths(self, client, server_id, path: str) -> List[str]:
+        # every directory path starts with its parent's path followed by "/", and "0" sorts right after "/"
+        prefix = "/" if path == "/" else f"{path}/"
+        upper = "(0" if path == "/" else f"({path}0"
+        found = await client.zrangebylex(self._key(server_id, "paths"), f"[{prefix}", upper)
+        return [p.decode() for p in found]
+
+    async def get_version(self, context: Context) -> int:
+        return _decode_version(await self.database.get(self._key(context.message.guild.id, "version")))
+
+    async def load(self, context: Context) -> Tree:
+        server_id = context.message.guild.id
+        version_key = self._key(server_id, "version")
+        while True:
+            pipe = self.database.pipeline(transaction=True)
+            pipe.zrange(self._key(server_id, "paths"), 0, -1)
+            pipe.get(version_key)
+            dir_paths, listed_version = await pipe.execute()
+            dir_paths = [p.decode() for p in dir_paths]
+
+            pipe = self.database.pipeline(transaction=True)
+            for path in dir_paths:
+                pipe.hgetall(self._dir_key(server_id, path))
+            pipe.get(version_key)
+            *dir_hashes, version = await pipe.execute()
+            # another worker saved between listing the directories and reading them
+            if version == listed_version:
+                break
+
+        ftree, dirs, totals = self._build_tree(dir_paths, dir_hashes)
+        ftree.version = _decode_version(version)
+        # kept by older versions without totals, which the next save fills in
+        ftree.stored_totals = all(path in totals for path in dirs if path != "/")
+        return ftree
+
+    async def load_paths(self, context: Context, paths: Iterable[TreePath]) -> Tree:
+        """Loads only the directories along paths, in one round trip. The tree is only meant for reading."""
+        server_id = context.message.guild.id
+        dir_paths = sorted({str(TreePath(path[:i])) for path in paths for i in range(len(path) + 1)} | {"/"})
+        pipe = self.database.pipeline(transaction=True)
+        for path in dir_paths:
+            pipe.hgetall(self._dir_key(server_id, path))
+        pipe.get(self._key(server_id, "version"))
+        *dir_hashes, version = await pipe.execute()
+
+        ftree, dirs, totals = self._build_tree(dir_paths, dir_hashes)
+        ftree.version = _decode_version(version)
+        ftree.is_partial = True
+        loaded = set(dir_paths)
+        for path, node in dirs.items():
+            if path not in loaded:
+                if path not in totals:
+                    return await self.load(context)  # stored before totals were kept
+                node._children = _UNLOADED
+                node.add_usage(*totals[path])
+        metrics.incr("partial_loads", "loads")
+        metrics.incr("partial_loads", "dirs", len(dir_paths))
+        return ftree
+
+    @staticmethod
+    def _build_tree(
+            dir_paths: List[str], dir_hashes: List[dict]
+    ) -> Tuple[Tree, Dict[str, Node], Dict[str, Tuple[int, int]]]:
+        # dir_paths must be sorted, and their hashes in the same order. Also returns the stored totals of
+        # the directories found, by path.
+        ftree = Tree()
+        dirs: Dict[str, Node] = {"/": ftree.root}
+        totals = {}
+        # parents always sort before their children in lexicographic order
+        for path, fields in zip(dir_paths, dir_hashes):
+            parent = dirs.get(path)
+            if parent is None:
+                continue
+            records = []
+            for name, record in fields.items():
+                name, record = name.decode(), record.decode()
+                if name.startswith(TOTALS_FIELD):
+                    totals[f"{path.rstrip('/')}/{name[len(TOTALS_FIELD):]}"] = _decode_totals(record)
+                else:
+                    records.append((_decode_record(record), name))
+            for (_, kind, link, size), name in sorted(records):
+                child = ftree.attach_node(parent, name, link if kind == FILE_RECORD else None, size)
+                if kind == DIR_RECORD:
+                    dirs[child.get_full_path()] = child
+        return ftree, dirs, totals
+
+    async def save(self, context: Context, ftree: Tree) -> bool:
+        if not ftree.is_dirty():
+            return False
+
+        server_id = context.message.guild.id
+        async with self.database.pipeline(transaction=True) as pipe:
+            version_key = self._key(server_id, "version")
+            await _watch_version(pipe, version_key, ftree.version)
+            removed_dirs = {}
+            for op, node in ftree.journal:
+                if op == "rm" and node.is_dir():
+                    path = node.get_full_path()
+                    stored_paths = await self._descendant_dir_paths(pipe, server_id, path)
+                    removed_dirs[path] = set(stored_paths) | set(_subtree_dir_paths(node))
+
+            pipe.multi()
+            self._queue_journal(pipe, server_id, ftree, removed_dirs)
+            pipe.incr(version_key)
+            ftree.version = (await _execute_watched(pipe, ftree.version))[-1]
+        ftree.mark_clean()
+        ftree.stored_totals = True
+        return True
+
+    def _queue_journal(self, pipe, server_id, ftree: Tree, removed_dirs: Dict[str, set]):
+        paths_key = self._key(server_id, "paths")
+        pipe.zadd(paths_key, {"/": 0})
+        for op, node in ftree.journal:
+            if op == "mk":
+                pipe.hset(self._dir_key(server_id, node.parent.get_full_path()), node.name, _encode_record(node))
+                if node.is_dir():
+                    pipe.zadd(paths_key, {node.get_full_path(): 0})
+            elif op == "rm":
+                pipe.hdel(
+                    self._dir_key(server_id, node.parent.get_full_path()), node.name, TOTALS_FIELD + node.name
+                )
+                if node.is_dir():
+                    dir_paths = removed_dirs[node.get_full_path()]
+                    pipe.delete(*[self._dir_key(server_id, p) for p in dir_paths])
+                    pipe.zrem(paths_key, *dir_paths)
+
+        for node in self._dirs_with_new_totals(ftree):
+            pipe.hset(self._dir_key(server_id, node.parent.get_full_path()), TOTALS_FIELD + node.name,
+                      _encode_totals(node))
+
+    @staticmethod
+    def _dirs_with_new_totals(ftree: Tree) -> List[Node]:
+        # every directory still in the tree that holds a node the journal touched, or all of them when the
+        # stored totals are incomplete
+        if not ftree.stored_totals:
+            return [node for node in ftree.iter_nodes() if node.is_dir() and node is not ftree.root]
+
+        changed = {}
+        for op, node in ftree.journal:
+            node = node if op == "mk" and node.is_dir() else node.parent
+            if not ftree.contains(node):
+                continue
+            while node is not ftree.root and node not in changed:
+                changed[node] = None
+                node = node.parent
+        return list(changed)
+
+
+class CachedStore:
+    """
+    Keeps recently used trees alive in a TreeCache in front of another store. A cached tree is only
+    trusted while its version still matches the one in redis, so a hit costs a single GET.
+    """
+    cache: TreeCache
+
+    def __init__(self, store, cache: TreeCache):
+        self.store = store
+        self.cache = cache
+
+    async def get_version(self, context: Context) -> int:
+        return await self.store.get_version(context)
+
+    async def _get_cached(self, context: Context) -> Optional[Tree]:
+        server_id = context.message.guild.id
+        ftree = self.cache.get(server_id, await self.store.get_version(context))
+        if ftree is not None and ftree.is_dirty():
+            # left behind by a command that failed before saving
+            self.cache.evict(server_id)
+            ftree = None
+        return ftree
+
+    async def load(self, context: Context) -> Tree:
+        ftree = await self._get_cached(context)
+        if ftree is None:
+            ftree = await self.store.load(context)
+            self.cache.put(context.message.guild.id, ftree)
+        return ftree
+
+    async def load_paths(self, context: Context, paths: Iterable[TreePath]) -> Tree:
+        # a current cached tree is cheaper than any load, but partial trees are never cached
+        ftree = await self._get_cached(context)
+        if ftree is None:
+            ftree = await self.store.load_paths(context, paths)
+            if not ftree.is_partial:
+                self.cache.put(context.message.guild.id, ftree)
+        return ftree
+
+    async def save(self, context: Context, ftree: Tree) -> bool:
+        server_id = context.message.guild.id
+        try:
+            written = await self.store.save(context, ftree)
+        except Exception:
+            # the cached object may hold changes that never made it to redis
+            self.cache.evict(server_id)
+            raise
+        self.cache.put(server_id, ftree)
+        return written
+
+
+class SessionStore:
+    """Keeps each user's pwd under its own key, expiring after ttl seconds without use."""
+    database: Redis
+
+    def __init__(self, database: Redis, ttl: int = cst.SESSION_TTL):
+        self.database = database
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(context: Context) -> str:
+        return f"{context.message.guild.id}:pwd:{context.message.author.id}"
+
+    async def get_pwd_path(self, context: Context) -> Optional[str]:
+        # GET and EXPIRE rather than GETEX, which needs redis 6.2
+        key = self._key(context)
+        pipe = self.database.pipeline(transaction=True)
+        pipe.get(key)
+        pipe.expire(key, self.ttl)
+        pwd_path, _ = await pipe.execute()
+        return pwd_path.decode() if pwd_path is not None else None
+
+    async def set_pwd_path(self, context: Context, pwd_path: str):
+        await self.database.set(self._key(context), pwd_path, ex=self.ttl)
+        metrics.incr("sessions", "cd")
+
+
+def _paths_to_load(pwd_path: str, paths: Iterable[str]) -> Optional[List[TreePath]]:
+    # the directories that resolving paths from pwd_path walks through, or None if it needs the whole tree
+    to_load = [TreePath.parse(pwd_path)]
+    for path in paths:
+        try:
+            plan = plan_cache.get(pwd_path, path, False)
+        except error.FolderbotError:
+            continue  # raised again when the command resolves the path itself
+        if any(step.is_glob for step in plan.steps):
+            return None
+        to_load += plan.paths
+    return to_load
+
+
+def _find_dir(ftree: Tree, path: Optional[str]) -> Optional[Node]:
+    if path is None:
+        return ftree.root
+    try:
+        node = ftree.get_node_from_path(path)
+    except error.NodeDoesNotExistError:
+        return None  # removed since the user moved there
+    return node if node.is_dir() else None
+
+
+class ReadWriteLock:
+    """An asyncio lock that many readers can hold at once, or one writer. Waiting writers go first."""
+
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @asynccontextmanager
+    async def read(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writing and self._writers_waiting == 0)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def write(self):
+        async with self._condition:
+            self._writers_waiting += 1
+            try:
+                await self._condition.wait_for(lambda: not self._writing and self._readers == 0)
+            finally:
+                # a writer cancelled while waiting must not keep readers out
+                self._writers_waiting -= 1
+                self._condition.notify_all()
+            self._writing = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class LockingStore:
+    """
+    Serializes access to each guild's tree within this process, and retries a mutation from a fresh load
+    when another process saved the guild first. Readers share the lock, since cached trees are live
+    objects that a writer would otherwise change underneath them. Trees are handed out with the pwd of
+    the user behind the command, from sessions, or the root when there are no sessions.
+    """
+
+    def __init__(self, store, retries: int = cst.SAVE_RETRIES, sessions: SessionStore = None):
+        self.store = store
+        self.retries = retries
+        self.sessions = sessions
+        self._locks = defaultdict(ReadWriteLock)
+
+    async def _load_with_pwd(self, context: Context, paths: Iterable[str] = None) -> Tuple[Tree, Node]:
+        if self.sessions is None:
+            pwd_path = None
+            ftree = await self._load(context, "/", paths)
+        elif paths is not None:
+            # the paths can only be planned once the pwd is known
+            pwd_path = await self.sessions.get_pwd_path(context)
+            ftree = await self._load(context, pwd_path or "/", paths)
+        else:
+            ftree, pwd_path = await asyncio.gather(self.store.load(context), self.sessions.get_pwd_path(context))
+
+        pwd = _find_dir(ftree, pwd_path)
+        if pwd is None and ftree.is_partial:
+            # the paths were planned from a pwd that is gone, and will be resolved from the root instead
+            ftree = await self.store.load(context)
+        return ftree, pwd or ftree.root
+
+    async def _load(self, context: Context, pwd_path: str, paths: Optional[Iterable[str]]) -> Tree:
+        to_load = _paths_to_load(pwd_path, paths) if paths is not None else None
+        if to_load is None:
+            return await self.store.load(context)
+        return await self.store.load_paths(context, to_load)
+
+    @asynccontextmanager
+    async def reading(self, context: Context, paths: Iterable[str] = None) -> AsyncIterator[Tree]:
+        """
+        Yields the guild's tree as seen from the user's pwd. When paths are given, the tree may only hold the
+        directories needed to resolve those paths and the pwd, and reaching past them raises
+        DirectoryNotLoadedError.
+        """
+        async with self._locks[context.message.guild.id].read():
+            ftree, pwd = await self._load_with_pwd(context, paths)
+            # other readers may be using the same cached tree from their own pwd
+            yield ftree.with_pwd(pwd)
+
+    async def change_dir(self, context: Context, path: str) -> str:
+        """Moves the user's pwd to the directory at path and returns its full path. The tree is not saved."""
+        async with self.reading(context, paths=[path]) as filetree:
+            filetree.change_dir(path)
+            pwd_path = filetree.get_pwd_path()
+        if self.sessions is not None:
+            await self.sessions.set_pwd_path(context, pwd_path)
+        return pwd_path
+
+    async def update(self, context: Context, mutate: Callable[[Tree], Any], label: str = "update") -> Any:
+        """
+        Loads the guild's tree, applies mutate to it and saves it if anything changed, returning whatever
+        mutate returned. mutate may run more than once, so it should only touch the tree it is given.
+        """
+        async with self._locks[context.message.guild.id].write():
+            for _ in range(self.retries):
+                ftree, pwd = await self._load_with_pwd(context)
+                ftree.pwd = pwd
+                try:
+                    result = mutate(ftree)
+                finally:
+                    ftree.pwd = ftree.root  # the tree may be cached, and is shared by every user
+                try:
+                    written = await self.store.save(context, ftree)
+                except error.VersionConflictError:
+                    metrics.incr("saves", f"{label}.conflicts")
+                    continue
+
+                metrics.incr("saves", f"{label}.written" if written else f"{label}.skipped")
+                return result
+
+        raise error.ConcurrentModificationError()
+
+
+STORES = {
+    "snapshot": SnapshotStore,
+    "nodes": NodeStore,
+}
+
+
+def make_store(
+        database: Redis,
+        backend: str = "snapshot",
+        cache: TreeCache = None,
+        compression: Optional[str] = None,
+        compression_min_bytes: int = cst.COMPRESSION_MIN_BYTES,
+        session_ttl: int = cst.SESSION_TTL,
+) -> LockingStore:
+    if backend == "snapshot":
+        store = SnapshotStore(database, compression=compression, compression_min_bytes=compression_min_bytes)
+    else:
+        store = STORES[backend](database)
+    if cache is not None:
+        store = CachedStore(store, cache)
+    return LockingStore(store, sessions=SessionStore(database, session_ttl))
@@ -1,52 +1,246 @@
-import dill
-from typing import Optional, List, Union
+import re
+import sys
+from types import MappingProxyType
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from redis import Redis
+from redis.asyncio import Redis
 from discord.ext.commands.context import Context
 
 import util
 import error
+import metrics
 import constants as cst
 from pathing import Filepaths
+from search import NameIndex
+from util import PathLike, TreePath
+
+_NO_CHILDREN = MappingProxyType({})  # shared by every file node
+
+
+class _UnloadedChildren(Mapping):
+    """Stands in for the children of a directory that a partial load left in storage."""
+
+    def __getitem__(self, name: str):
+        raise error.DirectoryNotLoadedError()
+
+    def __iter__(self):
+        raise error.DirectoryNotLoadedError()
+
+    def __len__(self) -> int:
+        raise error.DirectoryNotLoadedError()
+
+
+_UNLOADED = _UnloadedChildren()  # shared by every directory that was not loaded
+_ATTACHMENT_PREFIX = re.compile(rf"{re.escape(cst.ATTACHMENT_URL)}([1-9][0-9]*)/([1-9][0-9]*)/")
+_SNOWFLAKE_MASK = (1 << cst.SNOWFLAKE_BITS) - 1
+
+
+def pack_attachment(channel_id: int, attachment_id: int) -> int:
+    return (channel_id << cst.SNOWFLAKE_BITS) | attachment_id
+
+
+def unpack_attachment(packed: int) -> Tuple[int, int]:
+    return packed >> cst.SNOWFLAKE_BITS, packed & _SNOWFLAKE_MASK
+
+
+def _parse_attachment_prefix(prefix: str) -> Optional[int]:
+    # the channel and attachment ids of a discord cdn link, without the file name, packed into one int
+    match = _ATTACHMENT_PREFIX.fullmatch(prefix)
+    if match is None:
+        return None
+    channel_id, attachment_id = int(match[1]), int(match[2])
+    if channel_id > _SNOWFLAKE_MASK or attachment_id > _SNOWFLAKE_MASK:
+        return None
+    return pack_attachment(channel_id, attachment_id)
+
+
+def _index_children(children: Iterable["Node"]) -> Dict[str, "Node"]:
+    # trees pickled before children were indexed by name could hold a file and a folder with the same name,
+    # so the folder is renamed rather than dropped along with everything under it
+    children = list(children)
+    file_names = {child.name for child in children if not child.is_dir()}
+    taken = {child.name for child in children}
+    by_name = {}
+    for child in children:
+        if child.is_dir() and child.name in file_names:
+            name = child.name
+            while name in taken:
+                name = f"{name}{cst.RENAMED_DIR_SUFFIX}"
+            taken.add(name)
+            child.name = sys.intern(name)
+            metrics.incr("pickles", "renamed_dirs")
+        by_name[child.name] = child
+    return by_name
 
 
 class Node:
-    name: str
-    link: str
-    parent: "Node"
-    children: List["Node"]
+    __slots__ = (
+        "name", "is_last_child", "file_count", "total_bytes",
+        "_parent", "_children", "_link", "_link_ends_in_name", "_depth", "_path",
+    )
 
-    def __init__(self, name: str, link: Optional[str], parent: Union["Node", None]):
-        self.name = name
-        self.link = link
-        self.parent = parent
-        self.children = []
+    name: str
+    file_count: int  # files in this subtree, 1 for a file
+    total_bytes: int  # size of the files in this subtree, or of the file itself, 0 where unknown
+    _children: Dict[str, "Node"]  # keyed by name, in insertion order
+    _depth: Optional[int]  # cached, None until first needed
+    _path: Optional[str]  # cached, None until first needed
+
+    def __init__(self, name: str, link: Optional[str], parent: Union["Node", None], size: int = 0):
+        self.name = sys.intern(name)
+        self._parent = parent
+        self._depth = 0 if parent is None else None
+        self._path = None
         self.is_last_child = False
+        self.link = link
+        self._children = {} if link is None else _NO_CHILDREN
+        self.file_count = 0 if link is None else 1
+        self.total_bytes = 0 if link is None else size
+
+    def __getstate__(self):
+        return {
+            "name": self.name,
+            "link": self.link,
+            "parent": self.parent,
+            "is_last_child": self.is_last_child,
+            "size": self.total_bytes if not self.is_dir() else 0,
+            "children": list(self.children),
+        }
+
+    def __setstate__(self, state):
+        self.name = sys.intern(state["name"])
+        # the parent may not be unpickled yet
+        self._parent = state["parent"]
+        self._depth = None
+        self._path = None
+        self.is_last_child = state["is_last_child"]
+        self.link = state["link"]
+        # directory totals are summed by the tree afterwards
+        self.file_count = 0 if self.link is None else 1
+        self.total_bytes = 0 if self.link is None else state.get("size", 0)
+        # nodes pickled before children were indexed by name carry them in "children"
+        children = state.get("children", state.get("_children", {}))
+        if isinstance(children, dict):
+            children = children.values()
+        self._children = _index_children(children) if self.link is None else _NO_CHILDREN
+
+    @property
+    def parent(self) -> Optional["Node"]:
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent: Optional["Node"]):
+        self._parent = parent
+        # every cached depth and path below this node was derived from the old parent
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            node._depth = None
+            node._path = None
+            stack += node.children
+
+    @property
+    def link(self) -> Optional[str]:
+        if self._link.__class__ is int:
+            channel_id, attachment_id = unpack_attachment(self._link)
+            return f"{cst.ATTACHMENT_URL}{channel_id}/{attachment_id}/{self.name}"
+        if self._link_ends_in_name:
+            return self._link + self.name
+        return self._link
+
+    @link.setter
+    def link(self, link: Optional[str]):
+        # attachment links end in the file name, so only the prefix before it is kept, and discord cdn
+        # links only need their channel and attachment ids
+        if link is not None and link.endswith(f"/{self.name}"):
+            prefix = link[:-len(self.name)]
+            attachment = _parse_attachment_prefix(prefix)
+            self._link = prefix if attachment is None else attachment
+            self._link_ends_in_name = True
+        else:
+            self._link = link
+            self._link_ends_in_name = False
+
+    @property
+    def attachment(self) -> Optional[Tuple[int, int]]:
+        """The (channel id, attachment id) of a file uploaded to discord, if its link is a plain cdn link."""
+        if self._link.__class__ is int:
+            return unpack_attachment(self._link)
+        return None
+
+    @property
+    def children(self) -> Iterable["Node"]:
+        return self._children.values()
+
+    def get_child(self, name: str) -> Optional["Node"]:
+        return self._children.get(name)
+
+    def last_child(self) -> Optional["Node"]:
+        return next(reversed(self._children.values()), None)
+
+    def add_child(self, node: "Node"):
+        self._append_child(node)
+        self.add_usage(node.file_count, node.total_bytes)
+
+    def _append_child(self, node: "Node"):
+        # only the old and new tail change, so is_last_child stays correct without rescanning siblings
+        tail = self.last_child()
+        if tail is not None:
+            tail.is_last_child = False
+        self._children[node.name] = node
+        node.is_last_child = True
+
+    def remove_child(self, node: "Node"):
+        del self._children[node.name]
+        if node.is_last_child:
+            tail = self.last_child()
+            if tail is not None:
+                tail.is_last_child = True
+        self.add_usage(-node.file_count, -node.total_bytes)
+
+    def add_usage(self, file_count: int, total_bytes: int):
+        """Adds to the totals of this node and every directory above it, in O(depth)."""
+        node = self
+        while node is not None:
+            node.file_count += file_count
+            node.total_bytes += total_bytes
+            node = node._parent
 
     def is_dir(self) -> bool:
-        return self.link is None
+        return self._link is None
 
     def is_leaf(self) -> bool:
         return len(self.children) == 0
 
-    def get_full_path(self) -> str:
-        path = [self.name]
-        p = self.parent
-        while p is not None:
-            path.insert(0, p.name)
-            p = p.parent
+    def is_loaded(self) -> bool:
+        return self._children is not _UNLOADED
+
+    def _uncached_ancestry(self, attr: str) -> List["Node"]:
+        # this node and its ancestors up to, but not including, the nearest one with attr cached
+        nodes = []
+        node = self
+        while node is not None and getattr(node, attr) is None:
+            nodes.append(node)
+            node = node._parent
+        return nodes
 
-        path = "/".join(path)
-        path = util.clean_path(path)
-        return path
+    def get_full_path(self) -> str:
+        if self._path is None:
+            for node in reversed(self._uncached_ancestry("_path")):
+                if node._parent is None:
+                    node._path = node.name
+                elif node._parent._path == "/":
+                    node._path = f"/{node.name}"
+                else:
+                    node._path = f"{node._parent._path}/{node.name}"
+        return self._path
 
     def get_depth(self) -> int:
-        depth = 0
-        p = self.parent
-        while p is not None:
-            depth += 1
-            p = p.parent
-        return depth
+        if self._depth is None:
+            for node in reversed(self._uncached_ancestry("_depth")):
+                node._depth = 0 if node._parent is None else node._parent._depth + 1
+        return self._depth
 
 
 class Tree:
@@ -57,54 +251,198 @@ class Tree:
         self.root = Node("/", link=None, parent=None)
         self.root.is_last_child = True
         self.pwd = self.root
-
-    def get_node_from_path(self, path: str) -> Node:
-        path = util.clean_path(path)
-        pathlist = [x for x in path.split("/") if x != ""]
+        self.journal = []  # (op, node) records of changes since the last save
+        self.mutations = 0
+        self.node_count = 1
+        self.version = 0  # storage version this tree was loaded at or last saved as
+        self.log_ops = 0  # ops stored after the last snapshot, and their encoded size
+        self.log_bytes = 0
+        self.is_partial = False  # only the directories some command needed were loaded, see NodeStore
+        self.stored_totals = True  # the store has every directory's totals, see NodeStore
+        self._names = NameIndex()  # shared with views of the tree, so it is only built once
+
+    def __setstate__(self, state):
+        # trees pickled before the journal existed
+        self.__dict__.update(state)
+        self.journal = []
+        self.mutations = state.get("mutations", 0)
+        if "node_count" not in state:
+            self.node_count = sum(1 for _ in self.iter_nodes())
+        self.recount_usage()
+        self.version = state.get("version", 0)
+        self.log_ops = state.get("log_ops", 0)
+        self.log_bytes = state.get("log_bytes", 0)
+        self.is_partial = False
+        self.stored_totals = state.get("stored_totals", True)
+        self._names = NameIndex()
+
+    def iter_nodes(self):
+        return Tree._iter_subtree(self.root)
+
+    def name_index(self) -> NameIndex:
+        """The index of node names, built on first use and kept up to date by every change after that."""
+        if not self._names.is_built():
+            self._names.build(node for node in self.iter_nodes() if node is not self.root)
+        return self._names
+
+    def recount_usage(self):
+        """Works out every directory's totals, for trees built without add_child keeping them."""
+        nodes = list(self.iter_nodes())
+        for node in nodes:
+            if node.is_dir():
+                node.file_count = node.total_bytes = 0
+        for node in reversed(nodes):
+            if node._parent is not None:
+                node._parent.file_count += node.file_count
+                node._parent.total_bytes += node.total_bytes
+
+    @staticmethod
+    def _iter_subtree(node: Node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack += node.children
+
+    def walk(self, start: Node = None, max_depth: int = None) -> Iterator[Tuple[Node, int, bool]]:
+        """Yields (node, depth relative to start, is last child) in preorder, down to max_depth."""
+        stack = [(start or self.root, 0, True)]
+        while stack:
+            node, depth, is_last = stack.pop()
+            yield node, depth, is_last
+            if node.is_leaf() or (max_depth is not None and depth >= max_depth):
+                continue
+            # pushed last to first so that they pop in order
+            children = reversed(node.children)
+            stack.append((next(children), depth + 1, True))
+            stack += [(child, depth + 1, False) for child in children]
+
+    def _record(self, op: str, node: Node):
+        self.journal.append((op, node))
+        self.mutations += 1
+
+    def is_dirty(self) -> bool:
+        return len(self.journal) > 0
+
+    def mark_clean(self):
+        self.journal.clear()
+
+    def get_node_from_path(self, path: PathLike) -> Node:
+        path = TreePath.parse(path)
         cur_node = self.root
-        for item in pathlist:
-            found_child = False
-            for child in cur_node.children:
-                if item == child.name:
-                    cur_node = child
-                    found_child = True
-
-            if not found_child:
-                raise error.NodeDoesNotExistError(path)
+        for item in path:
+            cur_node = cur_node._children.get(item)
+            if cur_node is None:
+                raise error.NodeDoesNotExistError(str(path))
 
         return cur_node
 
-    def _create_node(self, path: str, name: str, is_file: bool, link: str):
+    def _create_node(self, path: TreePath, name: str, is_file: bool, link: str, size: int):
         assert not (is_file ^ (link is not None))
-        assert "/" not in name
-        assert name != "(empty)"
 
         link = str(link) if link else None
 
-        node = self.get_node_from_path(path)
-        if node.is_dir():
-            for child in node.children:
-                if name == child.name and is_file ^ child.is_dir():
-                    raise error.NodeExistsError(f"{path}/{name}")
+        _, failed = self.create_nodes(path, [(name, link, size)])
+        if len(failed) > 0:
+            raise failed[0][0]
+
+    def create_nodes(
+            self, path: PathLike, children: Iterable[Tuple]
+    ) -> Tuple[List[Node], List[Tuple[error.FolderbotError, str]]]:
+        """
+        Creates children of the node at path from (name, link) or (name, link, size), with a link of None for
+        directories. Returns the created nodes and (error, name) pairs for the ones that failed.
+        """
+        path = TreePath.parse(path)
+        parent = self.get_node_from_path(path)
+        created = []
+        failed = []
+        for name, link, *size in children:
+            assert "/" not in name
+            assert name != "(empty)"
+
+            if not parent.is_dir():
+                failed.append((error.CreateNodeUnderFileError(name, str(path)), name))
+            elif parent.get_child(name) is not None:
+                failed.append((error.NodeExistsError(str(path.child(name))), name))
+            else:
+                new_node = Node(name, link, parent=parent, size=size[0] if size else 0)
+                parent.add_child(new_node)
+                self._record("mk", new_node)
+                created.append(new_node)
+
+        self.node_count += len(created)
+        self._names.add(created)
+        return created, failed
+
+    def create_dirs(self, path: PathLike) -> List[Node]:
+        """Creates the directory at path and any missing parents, like mkdir -p. Returns the new ones."""
+        names = TreePath.parse(path)
+        node = self.root
+        depth = 0
+        while depth < len(names):
+            child = node.get_child(names[depth])
+            if child is None:
+                break
+            node = child
+            depth += 1
 
-            new_node = Node(name, link, parent=node)
-            node.children.append(new_node)
-            util.ensure_last_child_correct(node.children)
-        else:
-            raise error.CreateNodeUnderFileError(name, path)
+        created = []
+        for name in names[depth:]:
+            assert name != "(empty)"
+            if not node.is_dir():
+                raise error.CreateNodeUnderFileError(name, node.get_full_path())
+            node = self.attach_node(node, name, None)
+            self._record("mk", node)
+            created.append(node)
+        return created
+
+    def attach_node(self, parent: Node, name: str, link: Optional[str], size: int = 0) -> Node:
+        new_node = Node(name, link, parent=parent, size=size)
+        parent.add_child(new_node)
+        self.node_count += 1
+        self._names.add([new_node])
+        return new_node
+
+    def create_node(self, path: PathLike, is_file: bool = False, link: str = None, size: int = 0):
+        path = TreePath.parse(path)
+        if len(path) == 0:
+            raise error.NodeExistsError(str(path))
+        self._create_node(path.parent, path.name, is_file, link, size)
+
+    def contains(self, node: Node) -> bool:
+        while node._parent is not None:
+            if node._parent._children.get(node.name) is not node:
+                return False
+            node = node._parent
+        return node is self.root
+
+    def destroy_nodes(self, nodes: Iterable[Node]) -> Tuple[List[Node], List[Node]]:
+        """
+        Removes many nodes at once. Returns the removed nodes and the ones that were no longer in the
+        tree, such as those under a node removed before them.
+        """
+        nodes = list(nodes)
+        if any(node is self.root for node in nodes):
+            raise error.CannotRmRootError()
 
-    def create_node(self, path, is_file: bool = False, link: str = None):
-        path = util.clean_path(path)
-        existing_path = "/".join(path.split("/")[:-1])
-        new_dir_name = path.split("/")[-1]
-        self._create_node(existing_path, new_dir_name, is_file, link)
+        removed = []
+        missing = []
+        for node in nodes:
+            if not self.contains(node):
+                missing.append(node)
+                continue
+            node.parent.remove_child(node)
+            subtree = list(Tree._iter_subtree(node))
+            self.node_count -= len(subtree)
+            self._names.remove(subtree)
+            self._record("rm", node)
+            removed.append(node)
 
-    def destroy_node(self, path: str):
-        node = self.get_node_from_path(path)
-        if node is self.root:
-            raise error.CannotRmRootError()
-        node.parent.children.remove(node)
-        util.ensure_last_child_correct(node.parent.children)
+        return removed, missing
+
+    def destroy_node(self, path: PathLike):
+        self.destroy_nodes([self.get_node_from_path(path)])
 
     def _traverse(self, node: Node, depth: int, lines: [str]):
         node_details = {
@@ -144,27 +482,39 @@ class Tree:
         return self.pwd.get_full_path()
 
     def change_dir(self, path):
-        path = str(Filepaths(self, path))
-        cur_node = self.get_node_from_path(path)
+        # the path may be a pattern, so the node it matched is used rather than the path as typed
+        cur_node = Filepaths(self, path).get_target_nodes()[-1]
         if not cur_node.is_dir():
-            raise error.CannotCdError(path)
+            raise error.CannotCdError(cur_node.get_full_path())
 
+        # the pwd belongs to the user, not the tree, so moving it is not a change to save
         self.pwd = cur_node
 
+    def with_pwd(self, pwd: Node) -> "Tree":
+        """A read-only view of the tree that shares its nodes but has its own pwd."""
+        view = Tree.__new__(Tree)  # copy.copy would go through __setstate__, which is for old pickles
+        view.__dict__.update(self.__dict__)
+        view.pwd = pwd
+        return view
+
+
+async def save_filetree_state(
+        database: Redis, context: Context, ftree: Tree, compression: Optional[str] = None
+) -> bool:
+    if not ftree.is_dirty():
+        return False
 
-def save_filetree_state(database: Redis, context: Context, ftree: Tree):
+    from codec import compress_blob, serialize_filetree  # codec is built on Node and Tree
     server_id = context.message.guild.id
-    serialized_ftree = dill.dumps(ftree)
-    database.set(server_id, serialized_ftree)
+    await database.set(server_id, compress_blob(serialize_filetree(ftree), compression))
+    ftree.mark_clean()
+    return True
 
 
-def retrieve_filetree_state(database: Redis, context: Context) -> Tree:
+async def retrieve_filetree_state(database: Redis, context: Context) -> Tree:
+    from codec import decompress_blob, deserialize_filetree
     server_id = context.message.guild.id
-    serialized_ftree = database.get(server_id)
-    if serialized_ftree:
-        return dill.loads(serialized_ftree)
-    else:
-        return Tree()
+    return deserialize_filetree(decompress_blob(await database.get(server_id)))
 
 
 if __name__ == "__main__":  # pragma: no cover
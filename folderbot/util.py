@@ -1,13 +1,51 @@
-import re
+from typing import Iterable, Union
 
 import constants as cst
 
 
+class TreePath(tuple):
+    """
+    An absolute path in a file tree, held as the tuple of names below the root. Paths from users are turned
+    into one once, where they enter the bot, and code further in takes them as they are.
+    """
+    __slots__ = ()
+
+    def __new__(cls, names: Iterable[str] = ()):
+        return super().__new__(cls, names)
+
+    @classmethod
+    def parse(cls, path: Union[str, "TreePath"]) -> "TreePath":
+        if isinstance(path, TreePath):
+            return path
+        return cls(filter(None, path.split("/")))  # drops the empty names around repeated slashes
+
+    @property
+    def parent(self) -> "TreePath":
+        return TreePath(self[:-1])
+
+    @property
+    def name(self) -> str:
+        return self[-1]
+
+    def child(self, name: str) -> "TreePath":
+        return TreePath((*self, name))
+
+    def __str__(self) -> str:
+        return "/" + "/".join(self)
+
+    def __repr__(self) -> str:
+        return f"TreePath({str(self)!r})"
+
+
+PathLike = Union[str, TreePath]
+
+
 def clean_path(path: str) -> str:
-    newpath = re.sub(r"/{2,}", "/", path)
-    if len(newpath) > 1:
-        newpath = newpath[:-1] if newpath[-1] == "/" else newpath
-    return newpath
+    while "//" in path:
+        path = path.replace("//", "/")
+    if len(path) > 1 and path[-1] == "/":
+        path = path[:-1]
+    return path
 
 
 def ensure_last_child_correct(nodes):
@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.abspath('../folderbot'))
+
+# noinspection PyUnresolvedReferences
+import metrics
+# noinspection PyUnresolvedReferences
+from cache import TreeCache
+# noinspection PyUnresolvedReferences
+from tree import Tree
+
+
+class TestTreeCache(unittest.TestCase):
+    cache: TreeCache
+
+    def setUp(self) -> None:
+        metrics.reset()
+        self.cache = TreeCache(max_trees=2, max_bytes=TreeCache.estimate_bytes(Tree()) * 3)
+
+    def test_get_hit(self):
+        ftree = Tree()
+        self.cache.put("guild", ftree)
+        self.assertIs(ftree, self.cache.get("guild", 0))
+        self.assertEqual(1.0, self.cache.hit_ratio())
+
+    def test_get_stale_version(self):
+        self.cache.put("guild", Tree())
+        self.assertIsNone(self.cache.get("guild", 1))
+        self.assertNotIn("guild", self.cache)
+
+    def test_evict_least_recently_used(self):
+        self.cache.put("a", Tree())
+        self.cache.put("b", Tree())
+        self.cache.get("a", 0)
+        self.cache.put("c", Tree())
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+        self.assertEqual(1, metrics.get("tree_cache")["evictions"])
+
+    def test_evict_over_memory_cap(self):
+        big_tree = Tree()
+        big_tree.create_node("/node1", is_file=False, link=None)
+        big_tree.create_node("/node2", is_file=False, link=None)
+        self.cache.put("a", Tree())
+        self.cache.put("b", big_tree)
+        self.assertNotIn("a", self.cache)
+        self.assertIn("b", self.cache)
+
+    def test_put_too_large(self):
+        big_tree = Tree()
+        for i in range(3):
+            big_tree.create_node(f"/node{i}", is_file=False, link=None)
+        self.cache.put("a", big_tree)
+        self.assertEqual(0, len(self.cache))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
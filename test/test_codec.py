@@ -0,0 +1,151 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.abspath('../folderbot'))
+
+import dill
+
+# noinspection PyUnresolvedReferences
+import error
+# noinspection PyUnresolvedReferences
+from tree import Tree
+# noinspection PyUnresolvedReferences
+from codec import (
+    HEADER, MAGIC, compress_blob, decompress_blob, is_compressed, serialize_filetree, deserialize_filetree
+)
+
+
+class TestCodec(unittest.TestCase):
+    filetree: Tree
+
+    def setUp(self):
+        self.filetree = Tree()
+        self.filetree.create_node("/node1", is_file=False, link=None)
+        self.filetree.create_node("/node1/node2", is_file=False, link=None)
+        self.filetree.create_node("/node1/node2/fïlé.ext", is_file=True, link="https://cdn/1/2/fïlé.ext")
+        self.filetree.create_node("/node1/node2/copy.ext", is_file=True, link="fake_link")
+        self.filetree.create_node("/node1/node2/other.ext", is_file=True, link="fake_link")
+        self.filetree.create_node("/node1/empty", is_file=False, link=None)
+        self.filetree.change_dir("/node1/node2")
+
+    def test_round_trip(self):
+        decoded = deserialize_filetree(serialize_filetree(self.filetree))
+        self.assertListEqual(
+            [node.get_full_path() for node in self.filetree.iter_nodes()],
+            [node.get_full_path() for node in decoded.iter_nodes()],
+        )
+        self.assertEqual(self.filetree.node_count, decoded.node_count)
+        self.assertEqual("/node1/node2", decoded.get_pwd_path())
+        self.assertFalse(decoded.is_dirty())
+
+    def test_round_trip_links(self):
+        decoded = deserialize_filetree(serialize_filetree(self.filetree))
+        self.assertEqual("https://cdn/1/2/fïlé.ext", decoded.get_node_from_path("/node1/node2/fïlé.ext").link)
+        self.assertEqual("fake_link", decoded.get_node_from_path("/node1/node2/other.ext").link)
+        self.assertTrue(decoded.get_node_from_path("/node1/empty").is_dir())
+
+    def test_round_trip_last_child(self):
+        decoded = deserialize_filetree(serialize_filetree(self.filetree))
+        self.assertListEqual(
+            [node.is_last_child for node in self.filetree.iter_nodes()],
+            [node.is_last_child for node in decoded.iter_nodes()],
+        )
+
+    def test_links_are_stored_once(self):
+        header = HEADER.unpack_from(serialize_filetree(self.filetree))
+        self.assertEqual(2, header[4])
+
+    def test_round_trip_attachments(self):
+        for i in range(3):
+            link = f"https://cdn.discordapp.com/attachments/{900 + i % 2}/{950 + i}/img{i}.png"
+            self.filetree.create_node(f"/node1/img{i}.png", is_file=True, link=link)
+        serialized = serialize_filetree(self.filetree)
+        decoded = deserialize_filetree(serialized)
+
+        self.assertEqual((2, 3), HEADER.unpack_from(serialized)[-3:-1])  # channels are stored once
+        self.assertEqual(
+            "https://cdn.discordapp.com/attachments/900/952/img2.png",
+            decoded.get_node_from_path("/node1/img2.png").link,
+        )
+        self.assertEqual((901, 951), decoded.get_node_from_path("/node1/img1.png").attachment)
+
+    def test_round_trip_sizes(self):
+        self.filetree.create_node("/node1/node2/big.png", is_file=True, link="https://cdn/big.png", size=2048)
+        self.filetree.create_node("/node1/small.png", is_file=True, link="https://cdn/small.png", size=10)
+        decoded = deserialize_filetree(serialize_filetree(self.filetree))
+        self.assertEqual(2048, decoded.get_node_from_path("/node1/node2/big.png").total_bytes)
+        self.assertEqual((5, 2058), (decoded.root.file_count, decoded.root.total_bytes))
+        self.assertEqual((4, 2048), (decoded.get_node_from_path("/node1/node2").file_count,
+                                     decoded.get_node_from_path("/node1/node2").total_bytes))
+
+    def test_version_1(self):
+        serialized = (
+            b"FBT\x01\x03\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x07\x00\x00\x00+\x00\x00\x00"
+            b"\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00\x00\x05\x00\x00\x00"
+            b"\x00\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00+\x00\x00\x00\x00\x00\x01"
+            b"/af.pnghttps://cdn.discordapp.com/attachments/1/2/"
+        )
+        decoded = deserialize_filetree(serialized)
+        self.assertEqual("/a", decoded.get_pwd_path())
+        self.assertEqual((1, 2), decoded.get_node_from_path("/a/f.png").attachment)
+
+    def test_keeps_journal(self):
+        serialize_filetree(self.filetree)
+        self.assertTrue(self.filetree.is_dirty())
+        self.assertFalse(deserialize_filetree(serialize_filetree(self.filetree)).is_dirty())
+
+    def test_empty(self):
+        self.assertEqual(1, deserialize_filetree(None).node_count)
+        self.assertEqual(1, deserialize_filetree(serialize_filetree(Tree())).node_count)
+
+    def test_legacy_pickle(self):
+        decoded = deserialize_filetree(dill.dumps(self.filetree))
+        self.assertEqual("fake_link", decoded.get_node_from_path("/node1/node2/copy.ext").link)
+
+    def test_legacy_pickle_file_and_folder_with_same_name(self):
+        filetree = Tree()
+        filetree.create_dirs("/x/inner")
+        filetree.create_node("/y", is_file=True, link="fake_link")
+        filetree.get_node_from_path("/y").name = "x"  # older trees allowed this
+        decoded = deserialize_filetree(dill.dumps(filetree))
+        self.assertListEqual(["x (folder)", "x"], [child.name for child in decoded.root.children])
+        self.assertEqual("fake_link", decoded.get_node_from_path("/x").link)
+        self.assertTrue(decoded.get_node_from_path("/x (folder)/inner").is_dir())
+        self.assertEqual(4, decoded.node_count)
+
+    def test_unsupported_version(self):
+        serialized = bytearray(serialize_filetree(self.filetree))
+        serialized[len(MAGIC)] += 1
+        self.assertRaises(error.UnsupportedTreeFormatError, deserialize_filetree, bytes(serialized))
+
+
+class TestCompression(unittest.TestCase):
+    serialized: bytes
+
+    def setUp(self):
+        filetree = Tree()
+        for i in range(100):
+            filetree.create_node(f"/file{i}.png", is_file=True, link=f"https://cdn.discordapp.com/attachments/1/{i}/x")
+        self.serialized = serialize_filetree(filetree)
+
+    def test_round_trip(self):
+        for compression in ["zlib", "lzma"]:
+            compressed = compress_blob(self.serialized, compression, min_bytes=0)
+            self.assertTrue(is_compressed(compressed))
+            self.assertLess(len(compressed), len(self.serialized))
+            self.assertEqual(self.serialized, decompress_blob(compressed))
+
+    def test_below_min_bytes(self):
+        self.assertIs(self.serialized, compress_blob(self.serialized, "zlib", min_bytes=len(self.serialized) + 1))
+
+    def test_incompressible(self):
+        blob = os.urandom(8192)
+        self.assertIs(blob, compress_blob(blob, "zlib", min_bytes=0))
+
+    def test_uncompressed_passes_through(self):
+        self.assertIs(self.serialized, decompress_blob(self.serialized))
+        self.assertIsNone(decompress_blob(None))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
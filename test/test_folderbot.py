@@ -1,4 +1,28 @@
+import os
+import sys
+import asyncio
 import unittest
+from types import SimpleNamespace
+sys.path.append(os.path.abspath('../folderbot'))
+
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+
+# noinspection PyUnresolvedReferences
+import bot
+# noinspection PyUnresolvedReferences
+import error
+# noinspection PyUnresolvedReferences
+from cache import TreeCache
+# noinspection PyUnresolvedReferences
+from tree import Tree
+# noinspection PyUnresolvedReferences
+from storage import CachedStore, LockingStore, NodeStore, SnapshotStore
+
+
+class FakeAttachment(str):
+    """Stands in for a discord.Attachment, which turns into its url as a string."""
+    size = 1024
 
 
 class MyTestCase(unittest.TestCase):
@@ -6,5 +30,138 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(True, True)  # add assertion here
 
 
-if __name__ == '__main__': # pragma: no cover
+class TestRm(unittest.TestCase):
+    def test_rm_glob_with_nested_matches(self):
+        filetree = Tree()
+        filetree.create_dirs("/a/b/c")
+        filetree.create_node("/a/b/c/d.png", is_file=True, link="abc.com/d.png")
+        filetree.create_node("/a/e.png", is_file=True, link="abc.com/e.png")
+        success, fail = bot._rm_paths(filetree, "/a/**")
+        self.assertListEqual(["/a/b", "/a/e.png"], success)
+        self.assertListEqual([], fail)
+        self.assertEqual(2, filetree.node_count)
+
+    def test_rm_root_in_batch(self):
+        filetree = Tree()
+        filetree.create_dirs("/a")
+        filetree.create_dirs("/b")
+        filetree.change_dir("/a")
+        success, fail = bot._rm_paths(filetree, "/", "..", "/b")
+        self.assertListEqual(["/b"], success)
+        self.assertListEqual(["/", ".."], [path for _, path in fail])
+        self.assertTrue(all(isinstance(err, error.CannotRmRootError) for err, _ in fail))
+        self.assertEqual(2, filetree.node_count)
+
+
+class TestUpload(unittest.TestCase):
+    def test_upload_to_glob(self):
+        filetree = Tree()
+        filetree.create_dirs("/photos")
+        directory, success, fail = bot._upload_files(
+            filetree, "/phot*", [FakeAttachment("https://cdn.discordapp.com/attachments/1/2/a.png")]
+        )
+        self.assertEqual("/photos", directory)
+        self.assertEqual(1, len(success))
+        self.assertEqual(1024, filetree.get_node_from_path("/photos/a.png").total_bytes)
+
+
+class TestReadsSendAfterUnlocking(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = LockingStore(NodeStore(FakeRedis(server=FakeServer())))
+        bot.store = self.store
+        guild = SimpleNamespace(**{"id": "test_id"})
+        author = SimpleNamespace(**{"id": "user_id"})
+        self.context = SimpleNamespace(**{
+            "message": SimpleNamespace(**{"guild": guild, "author": author}), "send": self.send
+        })
+        self.sent = 0
+        await self.store.update(self.context, lambda filetree: bot._mk_paths(filetree, "/docs"), "mk")
+
+    async def send(self, **_):
+        # a writer can only get in if the command let go of its read lock before sending
+        await asyncio.wait_for(
+            self.store.update(self.context, lambda filetree: bot._mk_paths(filetree, f"/sent{self.sent}"), "mk"),
+            timeout=1,
+        )
+        self.sent += 1
+
+    async def test_reads(self):
+        await bot.ls.callback(self.context)
+        await bot.tree.callback(self.context)
+        await bot.tree.callback(self.context, "-f")
+        await bot.find.callback(self.context, "docs")
+        await bot.du.callback(self.context, "/nowhere")
+        self.assertEqual(5, self.sent)
+
+
+class TestLsErrors(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = LockingStore(NodeStore(FakeRedis(server=FakeServer())))
+        bot.store = self.store
+        guild = SimpleNamespace(**{"id": "test_id"})
+        author = SimpleNamespace(**{"id": "user_id"})
+        self.context = SimpleNamespace(**{
+            "message": SimpleNamespace(**{"guild": guild, "author": author}), "send": self.send
+        })
+        self.embeds = []
+
+    async def send(self, embed=None, **_):
+        self.embeds.append(embed)
+
+    async def test_ls_too_many_matches(self):
+        await self.store.update(
+            self.context, lambda filetree: filetree.create_nodes("/", [(f"d{i}", None) for i in range(1001)]), "mk"
+        )
+        await bot.ls.callback(self.context, "/**")
+        self.assertIn("error: ls", self.embeds[-1].title)
+        self.assertIn("Matches more than", self.embeds[-1].description)
+
+    async def test_ls_previous_from_root(self):
+        await bot.ls.callback(self.context, "..")
+        self.assertIn("error: ls", self.embeds[-1].title)
+
+
+class TestConcurrentUploads(unittest.IsolatedAsyncioTestCase):
+    uploads = 300
+    workers = 2
+
+    def make_context(self) -> SimpleNamespace:
+        guild = SimpleNamespace(**{"id": "test_id"})
+        return SimpleNamespace(**{"message": SimpleNamespace(**{"guild": guild})})
+
+    async def run_uploads(self, store_cls):
+        server = FakeServer()
+        # each worker has its own redis connection, tree cache and locks, like separate bot processes
+        stores = [
+            LockingStore(
+                CachedStore(store_cls(FakeRedis(server=server)), TreeCache(max_trees=8, max_bytes=2 ** 30)),
+                retries=self.uploads,
+            )
+            for _ in range(self.workers)
+        ]
+        context = self.make_context()
+        await stores[0].update(context, lambda filetree: bot._mk_paths(filetree, "/uploads"))
+
+        async def upload(i: int):
+            link = FakeAttachment(f"https://cdn.discordapp.com/attachments/1/{i}/file{i}.png")
+            store = stores[i % self.workers]
+            return await store.update(context, lambda filetree: bot._upload_files(filetree, "/uploads", [link]))
+
+        results = await asyncio.gather(*[upload(i) for i in range(self.uploads)])
+        self.assertTrue(all(len(success) == 1 for _, success, _ in results))
+
+        async with LockingStore(store_cls(FakeRedis(server=server))).reading(context) as filetree:
+            uploads = filetree.get_node_from_path("/uploads")
+            uploaded = {child.name for child in uploads.children}
+        self.assertSetEqual({f"file{i}.png" for i in range(self.uploads)}, uploaded)
+        self.assertEqual((self.uploads, self.uploads * FakeAttachment.size), (uploads.file_count, uploads.total_bytes))
+
+    async def test_concurrent_uploads_snapshot_store(self):
+        await self.run_uploads(SnapshotStore)
+
+    async def test_concurrent_uploads_node_store(self):
+        await self.run_uploads(NodeStore)
+
+
+if __name__ == '__main__':  # pragma: no cover
     unittest.main()
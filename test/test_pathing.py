@@ -0,0 +1,115 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.abspath('../folderbot'))
+
+# noinspection PyUnresolvedReferences
+import error
+# noinspection PyUnresolvedReferences
+import metrics
+# noinspection PyUnresolvedReferences
+from tree import Tree
+# noinspection PyUnresolvedReferences
+from pathing import Filepaths, PathPlanCache, plan_cache
+
+
+class TestPathPlans(unittest.TestCase):
+    filetree: Tree
+
+    def setUp(self) -> None:
+        self.filetree = Tree()
+        for path in ["/a", "/a/b", "/a/b/c", "/a/x", "/d"]:
+            self.filetree.create_node(path)
+        self.filetree.change_dir("/a/b/c")
+        plan_cache.clear()
+        metrics.reset()
+
+    def test_repeated_path_hits(self):
+        Filepaths(self.filetree, "../../x")
+        Filepaths(self.filetree, "../../x")
+        self.assertDictEqual({"hits": 1, "misses": 1}, metrics.get("path_plans"))
+
+    def test_key_includes_pwd(self):
+        self.assertEqual("/a/x", Filepaths(self.filetree, "../../x").get_target_nodes()[-1].get_full_path())
+        self.filetree.change_dir("/a/b")
+        self.assertEqual("/x", str(Filepaths(self.filetree, "../../x", is_mk_cmd=True)))
+        self.assertEqual(0, metrics.get("path_plans").get("hits", 0))
+
+    def test_plan_survives_mutations(self):
+        with self.assertRaises(error.NodeDoesNotExistError):
+            Filepaths(self.filetree, "../y")
+        self.filetree.create_node("/a/b/y")
+        self.assertEqual("/a/b/y", Filepaths(self.filetree, "../y").get_target_nodes()[-1].get_full_path())
+        self.assertEqual(1, metrics.get("path_plans")["hits"])
+
+    def test_step_climbs_from_pwd(self):
+        plan = plan_cache.get("/a/b/c", "../x", False)
+        self.assertEqual(1, plan.steps[-1].ups)
+        self.assertTupleEqual(("x",), plan.steps[-1].components)
+        plan = plan_cache.get("/a/b/c", "/d", False)
+        self.assertIsNone(plan.steps[-1].ups)
+
+    def test_bounded(self):
+        cache = PathPlanCache(max_plans=2)
+        for path in ["a", "b", "c"]:
+            cache.get("/", path, True)
+        self.assertEqual(2, len(cache))
+
+
+class TestGlobs(unittest.TestCase):
+    filetree: Tree
+
+    def setUp(self) -> None:
+        self.filetree = Tree()
+        self.filetree.create_dirs("/photos/2023/june")
+        self.filetree.create_dirs("/photos/2024")
+        self.filetree.create_dirs("/docs")
+        for path in ["/photos/2023/a.png", "/photos/2023/june/b.png", "/photos/2024/c.png",
+                     "/photos/2024/c.gif", "/docs/a.png", "/docs/[draft].txt"]:
+            self.filetree.create_node(path, is_file=True, link=f"abc.com{path}")
+        plan_cache.clear()
+        metrics.reset()
+
+    def glob(self, path: str, **kwargs) -> [str]:
+        plan = plan_cache.get(self.filetree.get_pwd_path(), path, False)
+        return [node.get_full_path() for node in plan.resolve(self.filetree, **kwargs)]
+
+    def test_wildcard_in_middle(self):
+        self.assertListEqual(["/photos/2023/a.png"], self.glob("/*/*/a.png"))
+        self.assertListEqual(["/photos/2024/c.png"], self.glob("/photos/20?4/*.png"))
+        self.assertListEqual(["/photos/2023", "/photos/2024"], self.glob("/photos/202[34]"))
+
+    def test_trailing_star_lists_children(self):
+        self.assertListEqual(["/docs/a.png", "/docs/[draft].txt"], self.glob("/docs/*"))
+
+    def test_any_depth(self):
+        self.assertListEqual(
+            ["/photos/2023/a.png", "/photos/2023/june/b.png", "/photos/2024/c.png"], self.glob("/photos/**/*.png")
+        )
+        self.assertListEqual(["/photos/2023/june/b.png"], self.glob("/**/june/**"))
+
+    def test_relative(self):
+        self.filetree.change_dir("/photos/2023")
+        self.assertListEqual(["/photos/2024/c.png", "/photos/2024/c.gif"], self.glob("../2024/c.*"))
+
+    def test_literal_name_with_glob_chars(self):
+        self.assertListEqual(["/docs/[draft].txt"], self.glob("/docs/[draft].txt"))
+
+    def test_no_match(self):
+        with self.assertRaises(error.NodeDoesNotExistError):
+            self.glob("/photos/*/*.jpg")
+        with self.assertRaises(error.NodeDoesNotExistError):
+            self.glob("/nothing/*")
+
+    def test_bounded(self):
+        self.assertEqual(4, len(self.glob("/**/*.png", limit=4)))
+        with self.assertRaises(error.InvalidFilepathError):
+            self.glob("/**/*.png", limit=3)
+
+    def test_mk_rejects_star(self):
+        with self.assertRaises(error.InvalidFilepathError):
+            Filepaths(self.filetree, "/photos/*/new", is_mk_cmd=True)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
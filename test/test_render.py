@@ -0,0 +1,102 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.abspath('../folderbot'))
+
+# noinspection PyUnresolvedReferences
+import constants as cst
+# noinspection PyUnresolvedReferences
+from tree import Tree
+# noinspection PyUnresolvedReferences
+from render import format_bytes, iter_ls_lines, iter_tree_lines, paginate
+
+
+class TestRenderTree(unittest.TestCase):
+    filetree: Tree
+
+    def setUp(self) -> None:
+        self.filetree = Tree()
+        self.filetree.create_node("/test1", is_file=False, link=None)
+        self.filetree.create_node("/test1/d1", is_file=False, link=None)
+        self.filetree.create_node("/test1/file.txt", is_file=True, link="abc.com/file.txt")
+        self.filetree.create_node("/test2", is_file=False, link=None)
+
+    def test_render_empty_tree(self):
+        self.assertListEqual([f"{cst.FOLDER_OPEN} __**/**__ *(empty)*"], list(iter_tree_lines(Tree())))
+
+    def test_render_tree(self):
+        self.filetree.change_dir("/test1")
+        expected = [
+            f"{cst.FOLDER_OPEN} /",
+            f"{cst.SPACE}{cst.PIPE_SIDE} {cst.FOLDER_OPEN} __**test1**__",
+            f"{cst.SPACE}{cst.PIPE}{cst.SPACE[1:]}{cst.PIPE_SIDE} {cst.FOLDER_OPEN} d1 *(empty)*",
+            f"{cst.SPACE}{cst.PIPE}{cst.SPACE[1:]}{cst.PIPE_END} [file.txt](abc.com/file.txt)",
+            f"{cst.SPACE}{cst.PIPE_END} {cst.FOLDER_OPEN} test2 *(empty)*",
+        ]
+        self.assertListEqual(expected, list(iter_tree_lines(self.filetree)))
+
+    def test_render_subtree_depth_limited(self):
+        self.filetree.create_node("/test1/d1/d2", is_file=False, link=None)
+        start = self.filetree.get_node_from_path("/test1")
+        expected = [
+            f"{cst.FOLDER_OPEN} test1",
+            f"{cst.SPACE}{cst.PIPE_SIDE} {cst.FOLDER_OPEN} d1",
+            f"{cst.SPACE}{cst.PIPE_END} [file.txt](abc.com/file.txt)",
+        ]
+        self.assertListEqual(expected, list(iter_tree_lines(self.filetree, start, max_depth=1)))
+
+    def test_render_matches_traverse(self):
+        self.assertEqual(len(self.filetree.traverse()), len(list(iter_tree_lines(self.filetree))))
+
+
+class TestRenderLs(unittest.TestCase):
+    def test_render_ls_empty(self):
+        self.assertListEqual(["*(empty)*"], list(iter_ls_lines(Tree().root)))
+
+    def test_render_ls_grid(self):
+        filetree = Tree()
+        for i in range(5):
+            filetree.create_node(f"/d{i}", is_file=False, link=None)
+        lines = list(iter_ls_lines(filetree.root, cols=2))
+        self.assertEqual(3, len(lines))
+        self.assertEqual(f"{cst.FOLDER_OPEN}d4 *(0 files, 0 B)*{cst.SPACE}", lines[-1])
+
+    def test_render_ls_usage(self):
+        filetree = Tree()
+        filetree.create_node("/d", is_file=False, link=None)
+        filetree.create_node("/d/a.png", is_file=True, link="abc.com/a.png", size=1536)
+        filetree.create_node("/b.txt", is_file=True, link="abc.com/b.txt")
+        self.assertListEqual(
+            [f"{cst.FOLDER_OPEN}d *(1 file, 1.5 KB)*{cst.SPACE}[b.txt](abc.com/b.txt){cst.SPACE}"],
+            list(iter_ls_lines(filetree.root)),
+        )
+
+    def test_format_bytes(self):
+        self.assertEqual("512 B", format_bytes(512))
+        self.assertEqual("2.0 MB", format_bytes(2 * 1024 * 1024))
+        self.assertEqual("2048.0 TB", format_bytes(2 * 1024 ** 5))
+
+
+class TestPaginate(unittest.TestCase):
+    def test_paginate_fits_one_page(self):
+        self.assertListEqual(["a\nb"], list(paginate(["a", "b"], limit=3)))
+
+    def test_paginate_splits_pages(self):
+        pages = list(paginate(["aa", "bb", "cc"], limit=5))
+        self.assertListEqual(["aa\nbb", "cc"], pages)
+
+    def test_paginate_truncates_long_line(self):
+        pages = list(paginate(["abcdef", "g"], limit=4))
+        self.assertListEqual([f"abc{cst.ELLIPSIS}", "g"], pages)
+
+    def test_paginate_is_lazy(self):
+        def lines():
+            yield "aa"
+            yield "bb"
+            raise AssertionError("pulled more lines than the first page needed")
+
+        self.assertEqual("aa", next(paginate(lines(), limit=3)))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
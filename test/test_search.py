@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+sys.path.append(os.path.abspath('../folderbot'))
+
+# noinspection PyUnresolvedReferences
+import metrics
+# noinspection PyUnresolvedReferences
+from tree import Tree
+# noinspection PyUnresolvedReferences
+from codec import serialize_filetree, deserialize_filetree
+# noinspection PyUnresolvedReferences
+from search import find_nodes
+
+
+class TestFind(unittest.TestCase):
+    filetree: Tree
+
+    def setUp(self) -> None:
+        self.filetree = Tree()
+        self.filetree.create_dirs("/reports/2023")
+        self.filetree.create_dirs("/photos/holiday")
+        self.filetree.create_node("/reports/2023/Q1_Report.pdf", is_file=True, link="abc.com/Q1_Report.pdf")
+        self.filetree.create_node("/reports/summary.pdf", is_file=True, link="abc.com/summary.pdf")
+        self.filetree.create_node("/photos/holiday/beach.png", is_file=True, link="abc.com/beach.png")
+        self.filetree.create_node("/photos/report.png", is_file=True, link="abc.com/report.png")
+        metrics.reset()
+
+    def find(self, pattern: str, start: str = None, **kwargs) -> [str]:
+        start = None if start is None else self.filetree.get_node_from_path(start)
+        return [node.get_full_path() for node in find_nodes(self.filetree, pattern, start, **kwargs)]
+
+    def test_substring_ranked(self):
+        self.assertListEqual(
+            ["/reports", "/photos/report.png", "/reports/2023/Q1_Report.pdf"], self.find("report")
+        )
+        self.assertEqual(1, metrics.get("find")["index_lookups"])
+
+    def test_substring_inside_word(self):
+        self.assertListEqual(["/photos/holiday"], self.find("lida"))
+
+    def test_extension_glob(self):
+        self.assertListEqual(["/reports/summary.pdf", "/reports/2023/Q1_Report.pdf"], self.find("*.PDF"))
+
+    def test_extension_glob_matches_like_scan(self):
+        self.filetree.create_node("/photos/shots.png")
+        self.filetree.create_node("/photos/.png", is_file=True, link="abc.com/.png")
+        expected = ["/photos/.png", "/photos/report.png", "/photos/shots.png", "/photos/holiday/beach.png"]
+        self.assertListEqual(expected, self.find("*.png"))
+        self.assertListEqual(expected, self.find("*png"))
+
+    def test_glob_with_words(self):
+        self.assertListEqual(["/reports/2023/Q1_Report.pdf"], self.find("q?_*.pdf"))
+        self.assertListEqual(["/photos/holiday/beach.png"], self.find("[ab]each.*"))
+
+    def test_glob_without_words_scans(self):
+        self.assertListEqual(["/reports/2023"], self.find("????"))
+        self.assertEqual(1, metrics.get("find")["scans"])
+        self.assertNotIn("index_builds", metrics.get("find"))
+
+    def test_under_path(self):
+        self.assertListEqual(["/photos/report.png"], self.find("report", start="/photos"))
+
+    def test_limit(self):
+        self.assertEqual(2, len(self.find("*.*", limit=2)))
+        self.assertEqual(1, len(self.find("*", limit=1)))
+
+    def test_index_follows_changes(self):
+        self.find("report")
+        self.filetree.create_node("/reports/report2.txt", is_file=True, link="abc.com/report2.txt")
+        self.filetree.destroy_node("/reports/2023")
+        self.assertListEqual(["/reports", "/photos/report.png", "/reports/report2.txt"], self.find("report"))
+        self.assertEqual(1, metrics.get("find")["index_builds"])
+
+    def test_decoded_tree(self):
+        decoded = deserialize_filetree(serialize_filetree(self.filetree))
+        self.assertListEqual(
+            ["/photos/report.png", "/photos/holiday/beach.png"],
+            [node.get_full_path() for node in find_nodes(decoded, "*.png")],
+        )
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
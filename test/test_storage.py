@@ -0,0 +1,373 @@
+import os
+import sys
+import asyncio
+import unittest
+from types import SimpleNamespace
+sys.path.append(os.path.abspath('../folderbot'))
+
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeConnection, FakeRedis
+
+# noinspection PyUnresolvedReferences
+import error
+# noinspection PyUnresolvedReferences
+import metrics
+# noinspection PyUnresolvedReferences
+from codec import is_compressed
+# noinspection PyUnresolvedReferences
+from pathing import Filepaths
+# noinspection PyUnresolvedReferences
+from util import TreePath
+# noinspection PyUnresolvedReferences
+from storage import CachedStore, LockingStore, NodeStore, ReadWriteLock, SessionStore, SnapshotStore, connect
+# noinspection PyUnresolvedReferences
+from cache import TreeCache
+
+
+def make_context(guild_id: str = "test_id", author_id: str = "user_id") -> SimpleNamespace:
+    guild = SimpleNamespace(**{"id": guild_id})
+    author = SimpleNamespace(**{"id": author_id})
+    message = SimpleNamespace(**{"guild": guild, "author": author})
+    return SimpleNamespace(**{"message": message})
+
+
+class TestNodeStore(unittest.IsolatedAsyncioTestCase):
+    redis: FakeRedis
+    store: NodeStore
+    context: SimpleNamespace
+
+    async def asyncSetUp(self):
+        self.redis = FakeRedis(server=FakeServer())
+        self.store = NodeStore(self.redis)
+        self.context = make_context()
+
+        filetree = await self.store.load(self.context)
+        filetree.create_node("/node1", is_file=False, link=None)
+        filetree.create_node("/node1/node2", is_file=False, link=None)
+        filetree.create_node("/node1/node2/node3", is_file=False, link=None)
+        filetree.create_node("/node1/node2/file.ext", is_file=True, link="fake_link")
+        filetree.create_node("/node1/a_file.ext", is_file=True, link="fake_link")
+        await self.store.save(self.context, filetree)
+
+    async def test_load_new(self):
+        filetree = await self.store.load(make_context("other_id"))
+        self.assertEqual(1, len(filetree.traverse()))
+
+    async def test_load_existing(self):
+        filetree = await self.store.load(self.context)
+        self.assertEqual(6, len(filetree.traverse()))
+        self.assertEqual("fake_link", filetree.get_node_from_path("/node1/node2/file.ext").link)
+
+    async def test_load_keeps_insertion_order(self):
+        filetree = await self.store.load(self.context)
+        child_names = [child.name for child in filetree.get_node_from_path("/node1").children]
+        self.assertListEqual(["node2", "a_file.ext"], child_names)
+
+    async def test_save_writes_only_touched_nodes(self):
+        filetree = await self.store.load(self.context)
+        filetree.create_node("/node1/node2/new.ext", is_file=True, link="new_link")
+        await self.redis.delete("folderbot:test_id:dir:/node1")  # only node2's totals are saved in it below
+        await self.store.save(self.context, filetree)
+
+        self.assertListEqual([b"/node2"], await self.redis.hkeys("folderbot:test_id:dir:/node1"))
+        self.assertEqual(4, await self.redis.hlen("folderbot:test_id:dir:/node1/node2"))
+
+    async def test_save_rm_dir_removes_subtree(self):
+        filetree = await self.store.load(self.context)
+        filetree.destroy_node("/node1/node2")
+        await self.store.save(self.context, filetree)
+
+        self.assertFalse(await self.redis.exists("folderbot:test_id:dir:/node1/node2"))
+        self.assertFalse(await self.redis.exists("folderbot:test_id:dir:/node1/node2/node3"))
+        self.assertEqual(3, len((await self.store.load(self.context)).traverse()))
+
+    async def test_load_paths(self):
+        filetree = await self.store.load_paths(self.context, [TreePath.parse("/node1/node2")])
+        self.assertTrue(filetree.is_partial)
+        self.assertListEqual(
+            ["node3", "file.ext"], [child.name for child in filetree.get_node_from_path("/node1/node2").children]
+        )
+        self.assertEqual("fake_link", filetree.get_node_from_path("/node1/a_file.ext").link)
+
+        unloaded = filetree.get_node_from_path("/node1/node2/node3")
+        self.assertFalse(unloaded.is_loaded())
+        self.assertRaises(error.DirectoryNotLoadedError, unloaded.get_child, "anything")
+
+    async def test_load_paths_keeps_totals(self):
+        filetree = await self.store.load(self.context)
+        filetree.create_node("/node1/node2/node3/big.png", is_file=True, link="https://cdn/big.png", size=500)
+        await self.store.save(self.context, filetree)
+
+        filetree = await self.store.load_paths(self.context, [TreePath.parse("/node1")])
+        node2 = filetree.get_node_from_path("/node1/node2")
+        self.assertFalse(node2.is_loaded())
+        self.assertEqual((2, 500), (node2.file_count, node2.total_bytes))
+        self.assertEqual((3, 500), (filetree.root.file_count, filetree.root.total_bytes))
+
+    async def test_totals_are_filled_in_for_old_records(self):
+        await self.redis.hdel("folderbot:test_id:dir:/node1", "/node2")  # as saved before totals were kept
+        self.assertFalse((await self.store.load_paths(self.context, [TreePath.parse("/node1")])).is_partial)
+
+        filetree = await self.store.load(self.context)
+        self.assertFalse(filetree.stored_totals)
+        filetree.create_node("/other", is_file=False, link=None)
+        await self.store.save(self.context, filetree)
+        self.assertTrue((await self.store.load_paths(self.context, [TreePath.parse("/node1")])).is_partial)
+
+    async def test_cd_is_not_saved(self):
+        filetree = await self.store.load(self.context)
+        filetree.change_dir("/node1/node2")
+        self.assertFalse(await self.store.save(self.context, filetree))
+        self.assertEqual("/", (await self.store.load(self.context)).get_pwd_path())
+
+
+class TestSnapshotStore(unittest.IsolatedAsyncioTestCase):
+    redis: FakeRedis
+    store: SnapshotStore
+    context: SimpleNamespace
+
+    async def asyncSetUp(self):
+        self.redis = FakeRedis(server=FakeServer())
+        self.store = SnapshotStore(self.redis, max_log_ops=4)
+        self.context = make_context()
+
+    async def test_round_trip(self):
+        filetree = await self.store.load(self.context)
+        filetree.create_node("/node1", is_file=False, link=None)
+        await self.store.save(self.context, filetree)
+        self.assertEqual(2, len((await self.store.load(self.context)).traverse()))
+
+    async def test_save_appends_ops(self):
+        filetree = await self.store.load(self.context)
+        filetree.create_node("/node1", is_file=False, link=None)
+        filetree.create_node("/node1/file.ext", is_file=True, link="https://cdn/1/file.ext")
+        await self.store.save(self.context, filetree)
+
+        self.assertFalse(await self.redis.exists("test_id"))
+        self.assertListEqual(
+            [b"mk /node1", b"up 22:0 https://cdn/1/file.ext /node1/file.ext"],
+            await self.redis.lrange("test_id:log", 0, -1),
+        )
+
+    async def test_load_replays_log(self):
+        filetree = await self.store.load(self.context)
+        filetree.create_node("/node1", is_file=False, link=None)
+        filetree.create_node("/node1/a file.ext", is_file=True, link="https://cdn/1/a file.ext")
+        filetree.create_node("/node2", is_file=False, link=None)
+        await self.store.save(self.context, filetree)
+        filetree.destroy_node("/node2")
+        await self.store.save(self.context, filetree)
+        await self.redis.rpush("test_id:log", "cd /node1")  # written when the pwd was kept in the tree
+
+        loaded = await self.store.load(self.context)
+        self.assertFalse(loaded.is_dirty())
+        self.assertEqual(3, len(loaded.traverse()))
+        self.assertEqual("/", loaded.get_pwd_path())
+        self.assertEqual("https://cdn/1/a file.ext", loaded.get_node_from_path("/node1/a file.ext").link)
+
+    async def test_load_replays_sizes(self):
+        filetree = await self.store.load(self.context)
+        filetree.create_node("/file.png", is_file=True, link="https://cdn/1/file.png", size=123)
+        await self.store.save(self.context, filetree)
+        await self.redis.rpush("test_id:log", "up 21 https://cdn/2/old.png /old.png")  # logged before sizes
+
+        loaded = await self.store.load(self.context)
+        self.assertEqual(123, loaded.get_node_from_path("/file.png").total_bytes)
+        self.assertEqual((2, 123), (loaded.root.file_count, loaded.root.total_bytes))
+
+    async def test_compacts_past_max_ops(self):
+        filetree = await self.store.load(self.context)
+        for i in range(4):
+            filetree.create_node(f"/node{i}", is_file=False, link=None)
+            await self.store.save(self.context, filetree)
+        self.assertEqual(4, await self.redis.llen("test_id:log"))
+
+        filetree.create_node("/node4", is_file=False, link=None)
+        await self.store.save(self.context, filetree)
+        self.assertEqual(0, await self.redis.llen("test_id:log"))
+        self.assertTrue(await self.redis.exists("test_id"))
+
+        filetree.create_node("/node5", is_file=False, link=None)
+        await self.store.save(self.context, filetree)
+        self.assertEqual(1, await self.redis.llen("test_id:log"))
+        self.assertEqual(7, len((await self.store.load(self.context)).traverse()))
+
+    async def test_failed_compaction_keeps_journal(self):
+        store = SnapshotStore(self.redis, max_log_ops=0)
+        filetree = await store.load(self.context)
+        filetree.create_node("/node1", is_file=False, link=None)
+        await self.redis.incr("test_id:version")  # saved elsewhere since this tree was loaded
+        with self.assertRaises(error.VersionConflictError):
+            await store.save(self.context, filetree)
+        self.assertTrue(filetree.is_dirty())
+
+    async def test_compressed_snapshot(self):
+        metrics.reset()
+        store = SnapshotStore(self.redis, max_log_ops=0, compression="zlib", compression_min_bytes=0)
+        filetree = await store.load(self.context)
+        for i in range(20):
+            filetree.create_node(f"/file{i}.png", is_file=True, link=f"https://cdn.discordapp.com/attachments/1/{i}/x")
+        await store.save(self.context, filetree)
+
+        self.assertTrue(is_compressed(await self.redis.get("test_id")))
+        self.assertEqual(21, len((await self.store.load(self.context)).traverse()))
+        counters = metrics.get("compression")
+        self.assertGreater(counters["test_id.raw_bytes"], counters["test_id.stored_bytes"])
+        self.assertEqual(1, counters["test_id.loads"])
+
+
+class TestCachedStore(unittest.IsolatedAsyncioTestCase):
+    redis: FakeRedis
+    store: CachedStore
+    context: SimpleNamespace
+
+    async def asyncSetUp(self):
+        self.redis = FakeRedis(server=FakeServer())
+        self.store = CachedStore(SnapshotStore(self.redis), TreeCache(max_trees=8, max_bytes=1024 * 1024))
+        self.context = make_context()
+        filetree = await self.store.load(self.context)
+        filetree.create_node("/node1", is_file=False, link=None)
+        await self.store.save(self.context, filetree)
+
+    async def test_load_hit_returns_live_tree(self):
+        self.assertIs(await self.store.load(self.context), await self.store.load(self.context))
+
+    async def test_load_revalidates_version(self):
+        cached = await self.store.load(self.context)
+        other_worker = SnapshotStore(self.redis)
+        filetree = await other_worker.load(self.context)
+        filetree.create_node("/node2", is_file=False, link=None)
+        await other_worker.save(self.context, filetree)
+
+        reloaded = await self.store.load(self.context)
+        self.assertIsNot(cached, reloaded)
+        self.assertEqual(3, len(reloaded.traverse()))
+
+
+class TestSessions(unittest.IsolatedAsyncioTestCase):
+    redis: FakeRedis
+    store: LockingStore
+    context: SimpleNamespace
+
+    async def asyncSetUp(self):
+        self.redis = FakeRedis(server=FakeServer())
+        self.store = LockingStore(
+            CachedStore(SnapshotStore(self.redis), TreeCache(max_trees=8, max_bytes=1024 * 1024)),
+            sessions=SessionStore(self.redis, ttl=60),
+        )
+        self.context = make_context()
+        await self.store.update(self.context, lambda filetree: filetree.create_dirs("/node1/node2"))
+
+    async def test_cd_writes_only_the_session(self):
+        version = await self.redis.get("test_id:version")
+        async with self.store.reading(self.context) as filetree:
+            cached = filetree.root
+
+        self.assertEqual("/node1", await self.store.change_dir(self.context, "node1"))
+        self.assertEqual(version, await self.redis.get("test_id:version"))
+        self.assertEqual(b"/node1", await self.redis.get("test_id:pwd:user_id"))
+        self.assertLessEqual(await self.redis.ttl("test_id:pwd:user_id"), 60)
+        async with self.store.reading(self.context) as filetree:
+            self.assertEqual("/node1", filetree.get_pwd_path())
+            self.assertIs(cached, filetree.root)
+
+    async def test_pwd_is_per_user(self):
+        other_user = make_context(author_id="other_id")
+        await self.store.change_dir(self.context, "/node1/node2")
+        await self.store.change_dir(other_user, "/node1")
+
+        async with self.store.reading(self.context) as filetree:
+            async with self.store.reading(other_user) as other_filetree:
+                self.assertEqual("/node1/node2", filetree.get_pwd_path())
+                self.assertEqual("/node1", other_filetree.get_pwd_path())
+
+    async def test_update_resolves_from_the_users_pwd(self):
+        await self.store.change_dir(self.context, "/node1")
+        created = await self.store.update(self.context, lambda filetree: filetree.create_dirs(
+            Filepaths(filetree, "node3", is_mk_cmd=True).get_path()
+        ))
+        self.assertEqual("/node1/node3", created[0].get_full_path())
+        async with self.store.reading(make_context(author_id="other_id")) as filetree:
+            self.assertEqual("/", filetree.get_pwd_path())
+
+    async def test_removed_pwd_falls_back_to_root(self):
+        await self.store.change_dir(self.context, "/node1/node2")
+        await self.store.update(self.context, lambda filetree: filetree.destroy_node("/node1"))
+        async with self.store.reading(self.context) as filetree:
+            self.assertEqual("/", filetree.get_pwd_path())
+
+
+class TestReadWriteLock(unittest.IsolatedAsyncioTestCase):
+    async def test_cancelled_writer_lets_readers_in(self):
+        lock = ReadWriteLock()
+        async with lock.read():
+            writer = asyncio.create_task(lock.write().__aenter__())
+            await asyncio.sleep(0)
+            writer.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await writer
+
+        async def read():
+            async with lock.read():
+                pass
+
+        await asyncio.wait_for(read(), timeout=1)
+
+
+class TestConnectionPool(unittest.IsolatedAsyncioTestCase):
+    async def test_more_guilds_than_connections(self):
+        database = connect(
+            "redis://localhost", max_connections=2, timeout=5, pool_timeout=5,
+            connection_class=FakeConnection, server=FakeServer(),
+        )
+        store = LockingStore(NodeStore(database))
+        contexts = [make_context(guild_id=f"guild{i}") for i in range(8)]
+        await asyncio.gather(*[
+            store.update(context, lambda filetree: filetree.create_node("/node1"), "mk") for context in contexts
+        ])
+        for context in contexts:
+            async with store.reading(context) as filetree:
+                self.assertEqual(2, filetree.node_count)
+
+
+class TestPartialReads(unittest.IsolatedAsyncioTestCase):
+    redis: FakeRedis
+    store: LockingStore
+    context: SimpleNamespace
+
+    async def asyncSetUp(self):
+        self.redis = FakeRedis(server=FakeServer())
+        self.store = LockingStore(NodeStore(self.redis), sessions=SessionStore(self.redis))
+        self.context = make_context()
+        await self.store.update(self.context, lambda filetree: [
+            filetree.create_dirs("/node1/node2/node3"), filetree.create_dirs("/other/deep")
+        ])
+
+    async def test_reads_only_the_paths(self):
+        await self.store.change_dir(self.context, "/node1")
+        async with self.store.reading(self.context, paths=["node2"]) as filetree:
+            self.assertTrue(filetree.is_partial)
+            self.assertEqual("/node1", filetree.get_pwd_path())
+            node = Filepaths(filetree, "node2").get_target_nodes()[-1]
+            self.assertListEqual(["node3"], [child.name for child in node.children])
+            self.assertFalse(filetree.get_node_from_path("/other").is_loaded())
+
+    async def test_all_items_reads_everything(self):
+        async with self.store.reading(self.context, paths=["/node1/*"]) as filetree:
+            self.assertFalse(filetree.is_partial)
+
+    async def test_removed_pwd_reads_everything(self):
+        await self.store.change_dir(self.context, "/other/deep")
+        await self.store.update(self.context, lambda filetree: filetree.destroy_node("/other"))
+        async with self.store.reading(self.context, paths=["node1/node2"]) as filetree:
+            self.assertEqual("/", filetree.get_pwd_path())
+            self.assertEqual(1, len(list(Filepaths(filetree, "node1/node2").get_target_nodes()[-1].children)))
+
+    async def test_cached_tree_is_used(self):
+        store = CachedStore(NodeStore(self.redis), TreeCache(max_trees=8, max_bytes=1024 * 1024))
+        cached = await store.load(self.context)
+        self.assertIs(cached, await store.load_paths(self.context, [TreePath.parse("/node1")]))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    unittest.main()
@@ -4,7 +4,8 @@ import unittest
 from types import SimpleNamespace
 sys.path.append(os.path.abspath('../folderbot'))
 
-from fakeredis import FakeServer, FakeStrictRedis
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
 
 # noinspection PyUnresolvedReferences
 from tree import Tree, save_filetree_state, retrieve_filetree_state
@@ -32,12 +33,91 @@ class TestCreateNode(unittest.TestCase):
         with self.assertRaises(error.NodeExistsError):
             self.filetree.create_node(f"/{self.node_name}", is_file=False, link=None)
 
+    def test_create_node_existent_other_type(self):
+        self.filetree.create_node(f"/{self.node_name}", is_file=False, link=None)
+        with self.assertRaises(error.NodeExistsError):
+            self.filetree.create_node(f"/{self.node_name}", is_file=True, link="some/link")
+
+    def test_create_node_keeps_order(self):
+        for i in range(3):
+            self.filetree.create_node(f"/{self.node_name}{i}", is_file=False, link=None)
+        self.filetree.destroy_node(f"/{self.node_name}1")
+        self.filetree.create_node(f"/{self.node_name}1", is_file=False, link=None)
+        child_names = [child.name for child in self.filetree.pwd.children]
+        self.assertListEqual([f"{self.node_name}{i}" for i in [0, 2, 1]], child_names)
+
+    def test_create_node_link(self):
+        self.filetree.create_node(f"/{self.node_name}.ext", is_file=True, link=f"abc.com/{self.node_name}.ext")
+        self.filetree.create_node("/other.ext", is_file=True, link="abc.com/renamed.ext")
+        self.assertEqual(f"abc.com/{self.node_name}.ext", self.filetree.get_node_from_path(f"/{self.node_name}.ext").link)
+        self.assertEqual("abc.com/renamed.ext", self.filetree.get_node_from_path("/other.ext").link)
+
+    def test_create_node_attachment_link(self):
+        link = f"https://cdn.discordapp.com/attachments/1012345678901234567/1023456789012345678/{self.node_name}.ext"
+        self.filetree.create_node(f"/{self.node_name}.ext", is_file=True, link=link)
+        node = self.filetree.get_node_from_path(f"/{self.node_name}.ext")
+        self.assertEqual(link, node.link)
+        self.assertEqual((1012345678901234567, 1023456789012345678), node.attachment)
+
+    def test_create_node_attachment_link_kept_as_text(self):
+        for name, link in [
+            ("zero.ext", "https://cdn.discordapp.com/attachments/01/2/zero.ext"),
+            ("query.ext", "https://cdn.discordapp.com/attachments/1/2/query.ext?ex=65"),
+            ("big.ext", f"https://cdn.discordapp.com/attachments/{2 ** 64}/2/big.ext"),
+        ]:
+            self.filetree.create_node(f"/{name}", is_file=True, link=link)
+            node = self.filetree.get_node_from_path(f"/{name}")
+            self.assertEqual(link, node.link)
+            self.assertIsNone(node.attachment)
+
     def test_create_node_under_file(self):
         self.filetree.create_node(f"/{self.node_name}", is_file=False, link=None)
         self.filetree.create_node(f"/{self.node_name}/{self.node_name}.ext", is_file=True, link="some/link")
         with self.assertRaises(error.CreateNodeUnderFileError):
             self.filetree.create_node(f"/{self.node_name}/{self.node_name}.ext/new_node", is_file=False, link=None)
 
+    def test_create_nodes(self):
+        self.filetree.create_node(f"/{self.node_name}0", is_file=False, link=None)
+        created, failed = self.filetree.create_nodes("/", [
+            (f"{self.node_name}1", None),
+            (f"{self.node_name}0", None),
+            (f"{self.node_name}2.ext", "some/link"),
+        ])
+        self.assertListEqual([f"{self.node_name}1", f"{self.node_name}2.ext"], [node.name for node in created])
+        self.assertEqual(1, len(failed))
+        self.assertIsInstance(failed[0][0], error.NodeExistsError)
+        self.assertListEqual([False, False, True], [child.is_last_child for child in self.filetree.root.children])
+        self.assertEqual(4, self.filetree.node_count)
+        self.assertEqual(3, len(self.filetree.journal))
+
+    def test_create_dirs(self):
+        self.filetree.create_node(f"/{self.node_name}")
+        created = self.filetree.create_dirs(f"/{self.node_name}/a/b")
+        self.assertListEqual([f"/{self.node_name}/a", f"/{self.node_name}/a/b"], [n.get_full_path() for n in created])
+        self.assertListEqual([], self.filetree.create_dirs(f"/{self.node_name}/a"))
+        self.assertEqual(4, self.filetree.node_count)
+        self.assertEqual(3, len(self.filetree.journal))
+
+    def test_create_dirs_under_file(self):
+        self.filetree.create_node(f"/{self.node_name}.ext", is_file=True, link="some/link")
+        with self.assertRaises(error.CreateNodeUnderFileError):
+            self.filetree.create_dirs(f"/{self.node_name}.ext/a/b")
+        self.assertEqual(2, self.filetree.node_count)
+
+    def test_get_required_parent_dirs_for_mk(self):
+        self.filetree.create_node(f"/{self.node_name}")
+        self.assertListEqual(
+            [f"/{self.node_name}/a", f"/{self.node_name}/a/b"],
+            get_required_parent_dirs_for_mk(self.filetree, f"/{self.node_name}/a/b"),
+        )
+        self.assertListEqual([], get_required_parent_dirs_for_mk(self.filetree, f"/{self.node_name}"))
+
+    def test_create_nodes_under_file(self):
+        self.filetree.create_node(f"/{self.node_name}.ext", is_file=True, link="some/link")
+        created, failed = self.filetree.create_nodes(f"/{self.node_name}.ext", [("a", None), ("b", None)])
+        self.assertListEqual([], created)
+        self.assertTrue(all(isinstance(err, error.CreateNodeUnderFileError) for err, _ in failed))
+
 
 class TestDestroyNode(unittest.TestCase):
     filetree: Tree
@@ -61,6 +141,35 @@ class TestDestroyNode(unittest.TestCase):
         with self.assertRaises(error.CannotRmRootError):
             self.filetree.destroy_node(f"/")
 
+    def test_destroy_nodes(self):
+        for path in ["/a", "/a/b", "/c", "/d"]:
+            self.filetree.create_node(path)
+        nodes = [self.filetree.get_node_from_path(path) for path in ["/a", "/a/b", "/d"]]
+        removed, missing = self.filetree.destroy_nodes(nodes)
+
+        self.assertListEqual(["/a", "/d"], [node.get_full_path() for node in removed])
+        self.assertListEqual(["/a/b"], [node.get_full_path() for node in missing])
+        self.assertListEqual(["c"], [child.name for child in self.filetree.root.children])
+        self.assertTrue(self.filetree.get_node_from_path("/c").is_last_child)
+        self.assertEqual(2, self.filetree.node_count)
+
+    def test_destroy_node_keeps_last_child(self):
+        for i in range(4):
+            self.filetree.create_node(f"/{self.node_name}{i}")
+        self.filetree.destroy_node(f"/{self.node_name}1")
+        self.filetree.destroy_node(f"/{self.node_name}3")
+        self.assertListEqual([False, True], [child.is_last_child for child in self.filetree.root.children])
+
+        self.filetree.create_node(f"/{self.node_name}4")
+        self.assertListEqual([False, False, True], [child.is_last_child for child in self.filetree.root.children])
+
+    def test_destroy_nodes_root(self):
+        self.filetree.create_node(f"/{self.node_name}")
+        nodes = [self.filetree.get_node_from_path(f"/{self.node_name}"), self.filetree.root]
+        with self.assertRaises(error.CannotRmRootError):
+            self.filetree.destroy_nodes(nodes)
+        self.assertEqual(2, self.filetree.node_count)
+
 
 class TestTreeFunctionality(unittest.TestCase):
     filetree: Tree
@@ -85,6 +194,35 @@ class TestTreeFunctionality(unittest.TestCase):
         with self.assertRaises(error.NodeDoesNotExistError):
             self.filetree.get_node_from_path("/test1/d1/non_existent")
 
+    def test_get_full_path_and_depth(self):
+        node = self.filetree.get_node_from_path("/test1/d1/d2/file.txt")
+        self.assertEqual("/test1/d1/d2/file.txt", node.get_full_path())
+        self.assertEqual(4, node.get_depth())
+        self.assertEqual("/", self.filetree.root.get_full_path())
+
+    def test_reparent_invalidates_cached_paths(self):
+        d1 = self.filetree.get_node_from_path("/test1/d1")
+        file_node = self.filetree.get_node_from_path("/test1/d1/d2/file.txt")
+        file_node.get_full_path()
+
+        test2 = self.filetree.get_node_from_path("/test2")
+        d1.parent.remove_child(d1)
+        d1.parent = test2
+        test2.add_child(d1)
+
+        self.assertEqual("/test2/d1/d2/file.txt", file_node.get_full_path())
+        self.assertIs(file_node, self.filetree.get_node_from_path("/test2/d1/d2/file.txt"))
+
+    def test_walk(self):
+        walked = [(node.name, depth) for node, depth, _ in self.filetree.walk()]
+        self.assertEqual(8, len(walked))
+        self.assertEqual(("file.txt", 4), walked[4])
+
+    def test_walk_subtree_depth_limited(self):
+        start = self.filetree.get_node_from_path("/test1/d1")
+        walked = [(node.name, depth, is_last) for node, depth, is_last in self.filetree.walk(start, max_depth=1)]
+        self.assertListEqual([("d1", 0, True), ("d2", 1, False), ("file.txt", 1, True)], walked)
+
     def test_traverse(self):
         traversed_lines = self.filetree.traverse()
         self.assertEqual(8, len(traversed_lines))
@@ -125,15 +263,87 @@ class TestFiletreeCd(unittest.TestCase):
         with self.assertRaises(error.CannotCdError):
             self.filetree.change_dir(cd_dir)
 
+    def test_cd_glob(self):
+        self.filetree.change_dir("/node1/n*2")
+        self.assertEqual("/node1/node2", self.filetree.get_pwd_path())
+
     def test_cd_to_nonexistent_node(self):
         cd_dir = "/node1/node2/does_not_exist"
         with self.assertRaises(error.NodeDoesNotExistError):
             self.filetree.change_dir(cd_dir)
 
 
-class TestFiletreeState(unittest.TestCase):
+class TestUsage(unittest.TestCase):
     filetree: Tree
-    redis: FakeStrictRedis
+
+    def setUp(self) -> None:
+        self.filetree = Tree()
+        self.filetree.create_dirs("/test1/d1")
+        self.filetree.create_node("/test1/a.png", is_file=True, link="abc.com/a.png", size=100)
+        self.filetree.create_nodes("/test1/d1", [("b.png", "abc.com/b.png", 20), ("c.txt", "abc.com/c.txt")])
+
+    def usage(self, path: str) -> (int, int):
+        node = self.filetree.get_node_from_path(path)
+        return node.file_count, node.total_bytes
+
+    def test_create_updates_ancestors(self):
+        self.assertEqual((3, 120), self.usage("/"))
+        self.assertEqual((3, 120), self.usage("/test1"))
+        self.assertEqual((2, 20), self.usage("/test1/d1"))
+        self.assertEqual((1, 100), self.usage("/test1/a.png"))
+
+    def test_destroy_updates_ancestors(self):
+        self.filetree.destroy_node("/test1/d1")
+        self.assertEqual((1, 100), self.usage("/"))
+        self.filetree.destroy_node("/test1/a.png")
+        self.assertEqual((0, 0), self.usage("/test1"))
+
+    def test_recount_usage(self):
+        for node in self.filetree.iter_nodes():
+            if node.is_dir():
+                node.file_count = node.total_bytes = 0
+        self.filetree.recount_usage()
+        self.assertEqual((3, 120), self.usage("/"))
+        self.assertEqual((2, 20), self.usage("/test1/d1"))
+
+
+class TestDirtyTracking(unittest.TestCase):
+    filetree: Tree
+
+    def setUp(self) -> None:
+        self.filetree = Tree()
+        self.filetree.create_node("/node1", is_file=False, link=None)
+        self.filetree.mark_clean()
+
+    def test_mutation_marks_dirty(self):
+        self.filetree.create_node("/node1/node2", is_file=False, link=None)
+        self.assertTrue(self.filetree.is_dirty())
+        self.assertEqual(2, self.filetree.mutations)
+
+    def test_failed_mutation_stays_clean(self):
+        with self.assertRaises(error.NodeExistsError):
+            self.filetree.create_node("/node1", is_file=False, link=None)
+        with self.assertRaises(error.NodeDoesNotExistError):
+            self.filetree.destroy_node("/does_not_exist")
+        with self.assertRaises(error.NodeDoesNotExistError):
+            self.filetree.change_dir("/does_not_exist")
+        self.assertFalse(self.filetree.is_dirty())
+
+    def test_node_count(self):
+        self.filetree.create_node("/node1/node2", is_file=False, link=None)
+        self.filetree.create_node("/node1/node2/file.ext", is_file=True, link="fake_link")
+        self.assertEqual(4, self.filetree.node_count)
+        self.filetree.destroy_node("/node1")
+        self.assertEqual(1, self.filetree.node_count)
+
+    def test_cd_to_pwd_stays_clean(self):
+        self.filetree.change_dir("/")
+        self.assertFalse(self.filetree.is_dirty())
+
+
+class TestFiletreeState(unittest.IsolatedAsyncioTestCase):
+    filetree: Tree
+    redis: FakeRedis
     context: SimpleNamespace
 
     def setUp(self):
@@ -143,7 +353,7 @@ class TestFiletreeState(unittest.TestCase):
         self.filetree.create_node("/node1/node2/node3", is_file=False, link=None)
         self.filetree.create_node("/node1/node2/file.ext", is_file=True, link="fake_link")
 
-        self.redis = FakeStrictRedis(server=FakeServer())
+        self.redis = FakeRedis(server=FakeServer())
 
         guild = SimpleNamespace(**{"id": "test_id"})
         message = SimpleNamespace(**{"guild": guild})
@@ -151,14 +361,20 @@ class TestFiletreeState(unittest.TestCase):
             "message": message
         })
 
-    def test_retrieve_filetree_state_existing(self):
-        save_filetree_state(database=self.redis, context=self.context, ftree=self.filetree)
-        ret_filetree = retrieve_filetree_state(database=self.redis, context=self.context)
+    async def test_retrieve_filetree_state_existing(self):
+        await save_filetree_state(database=self.redis, context=self.context, ftree=self.filetree)
+        ret_filetree = await retrieve_filetree_state(database=self.redis, context=self.context)
         traversed_nodes = ret_filetree.traverse()
         self.assertEqual(5, len(traversed_nodes))
 
-    def test_retreive_filetree_state_new(self):
-        ret_filetree = retrieve_filetree_state(database=self.redis, context=self.context)
+    async def test_save_filetree_state_clean(self):
+        await save_filetree_state(database=self.redis, context=self.context, ftree=self.filetree)
+        await self.redis.flushall()
+        self.assertFalse(await save_filetree_state(database=self.redis, context=self.context, ftree=self.filetree))
+        self.assertIsNone(await self.redis.get("test_id"))
+
+    async def test_retreive_filetree_state_new(self):
+        ret_filetree = await retrieve_filetree_state(database=self.redis, context=self.context)
         traversed_nodes = ret_filetree.traverse()
         self.assertEqual(1, len(traversed_nodes))
 
@@ -28,6 +28,25 @@ class TestCleanPath(unittest.TestCase):
         self.assertEqual("../../node1/node2/../node3/..", out_path)
 
 
+class TestTreePath(unittest.TestCase):
+    def test_parse(self):
+        path = util.TreePath.parse("//node1//node2/")
+        self.assertEqual(("node1", "node2"), path)
+        self.assertIs(path, util.TreePath.parse(path))
+        self.assertEqual((), util.TreePath.parse("/"))
+
+    def test_str(self):
+        self.assertEqual("/node1/node2", str(util.TreePath(("node1", "node2"))))
+        self.assertEqual("/", str(util.TreePath()))
+
+    def test_parent_child(self):
+        path = util.TreePath.parse("/node1/node2")
+        self.assertEqual("node2", path.name)
+        self.assertEqual("/node1", str(path.parent))
+        self.assertEqual(path, path.parent.child("node2"))
+        self.assertIsInstance(path.child("x"), util.TreePath)
+
+
 class TestEnsureLastChildCorrect(unittest.TestCase):
     nodes: [Node]
 